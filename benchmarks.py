@@ -0,0 +1,203 @@
+"""Benchmark functions."""
+import time
+import numpy as np
+from time_domain_astronomy_sandbox.backend import Backend
+from time_domain_astronomy_sandbox.observation import Observation
+from time_domain_astronomy_sandbox.pulse import Pulse
+from time_domain_astronomy_sandbox.rfim import RFIm
+from time_domain_astronomy_sandbox.snr import SNR
+from time_domain_astronomy_sandbox.streaming_rfim import StreamingTimeCleaner, StreamingFrequencyCleaner
+from time_domain_astronomy_sandbox.parallel import n_workers
+from time_domain_astronomy_sandbox.campaign import Population, Campaign
+
+
+def _best_time(function, data, repeats):
+    """Best wall time (in second) of function applied to copies of data, and its last output."""
+    best = np.inf
+    for _ in range(repeats):
+        copy = data.copy()
+        start_time = time.perf_counter()
+        function(copy)
+        best = min(best, time.perf_counter() - start_time)
+    return best, copy
+
+
+def benchmark_rfim_chain(length=2, steps=('dm0', 'time', 'frequency'), tile_sizes=(64, 128, 256), repeats=3):
+    """Compare the sequential RFIm chain to RFIm.fused_chain on a full size ARTS window."""
+    np.random.seed(0)
+    obs = Observation(Backend(), length=length)
+    obs.add_dispersed_pulse(dm=100, width=0.006, pulse_t0=0.23, snr=125)
+    for t_start, f_start, f_stop in [[0., 350, 360], [0.1, 700, 715]]:
+        obs.add_rfi(t_start=t_start, t_stop=t_start+0.3, t_step=0.01, t_width=0.003, f_start=f_start, f_stop=f_stop, snr=125)
+
+    rfim = RFIm()
+    functions = {'dm0': rfim.dm0clean, 'time': rfim.tdsc_amber, 'frequency': rfim.fdsc_amber}
+
+    def sequential(data):
+        for step in steps:
+            name, kwargs = (step, {}) if isinstance(step, str) else step
+            functions[name](data, **kwargs)
+
+    reference_time, reference = _best_time(sequential, obs.window, repeats)
+    reference_flags = reference != obs.window
+    print("window %s, %.0f MB" % (obs.window.shape, obs.window.nbytes / 2**20))
+    print("sequential:      %.3f s" % reference_time)
+    for tile_size in tile_sizes:
+        fused_time, fused = _best_time(lambda data: rfim.fused_chain(data, steps, tile_size=tile_size), obs.window, repeats)
+        flags = fused != obs.window
+        agreement = (flags == reference_flags).mean()
+        print("fused (tile %4d): %.3f s, speedup %.2f, flags agreeing %.6f" % (tile_size, fused_time, reference_time / fused_time, agreement))
+
+
+def benchmark_workers(length=2, workers=(1, 2, 4, 8, 16, 32), n_dms=64, repeats=3):
+    """Scaling of the RFIm cleaners and dedispersion with the number of threads on a full size ARTS window."""
+    np.random.seed(0)
+    obs = Observation(Backend(), length=length)
+    rfim = RFIm()
+    dms = np.linspace(0, 1000, n_dms)
+    functions = {'dm0clean': rfim.dm0clean,
+                 'tdsc_amber': rfim.tdsc_amber,
+                 'fdsc_amber': rfim.fdsc_amber,
+                 'spectral_kurtosis': rfim.spectral_kurtosis,
+                 'dedisperse': lambda data, workers: obs.dedisperse(500, window=data, workers=workers),
+                 'dedisperse_many': lambda data, workers: obs.dedisperse_many(dms, window=data, workers=workers)}
+
+    print("window %s, %d CPUs" % (obs.window.shape, n_workers(None)))
+    print("%-18s" % "workers" + "".join("%9d" % n for n in workers))
+    for name, function in functions.items():
+        times = [_best_time(lambda data: function(data, workers=n), obs.window, repeats)[0] for n in workers]
+        print("%-18s" % name + "".join("%8.3fs" % t for t in times))
+        print("%-18s" % "  speedup" + "".join("%9.2f" % (times[0] / t) for t in times))
+
+
+def benchmark_boxcar(n_dm=5000, n_samples=12500, workers=(1, 2, 4, 8), repeats=3):
+    """Time the boxcar search (SNR.boxcar_peak, 8 widths) of a float32 DM-time plane per number of threads."""
+    plane = np.random.default_rng(0).normal(size=(n_dm, n_samples)).astype(np.float32)
+    print("plane %s, %d CPUs" % (plane.shape, n_workers(None)))
+    times = [_best_time(lambda data: SNR().boxcar_peak(data, workers=n), plane, repeats)[0] for n in workers]
+    print("%-18s" % "workers" + "".join("%9d" % n for n in workers))
+    print("%-18s" % "boxcar_peak" + "".join("%8.3fs" % t for t in times))
+
+
+def benchmark_out_of_core(filename, length=10, chunk_size=12500, n_dms=32):
+    """Time cleaning and dedispersion of a memory-mapped ARTS observation, written to filename, chunk by chunk."""
+    np.random.seed(0)
+    start_time = time.perf_counter()
+    obs = Observation(Backend(), length=length, filename=filename, chunk_size=chunk_size)
+    print("window %s, %.0f MB, created in %.3f s" % (obs.window.shape, obs.window.nbytes / 2**20,
+                                                     time.perf_counter() - start_time))
+    steps = {'time_cleaning': obs.time_cleaning,
+             'frequency_cleaning': obs.frequency_cleaning,
+             'dedisperse_many': lambda: obs.dedisperse_many(np.linspace(0, 1000, n_dms))}
+    for name, step in steps.items():
+        start_time = time.perf_counter()
+        step()
+        obs.flush()
+        print("%-18s %.3f s" % (name, time.perf_counter() - start_time))
+
+
+def benchmark_dtypes(length=2, dtypes=(np.float64, np.float32, np.float16, np.uint8), n_dms=32, repeats=3):
+    """Memory and throughput of cleaning and dedispersion of a full size ARTS window per data type."""
+    rfim = RFIm()
+    dms = np.linspace(0, 1000, n_dms)
+    print("%-8s %8s %12s %12s %12s" % ("dtype", "MB", "tdsc_amber", "fdsc_amber", "dedisperse"))
+    for dtype in dtypes:
+        obs = Observation(Backend(), length=length, seed=0, dtype=dtype)
+        times = [_best_time(function, obs.window, repeats)[0]
+                 for function in (rfim.tdsc_amber, rfim.fdsc_amber,
+                                  lambda data: obs.dedisperse_many(dms, window=data))]
+        print("%-8s %8.0f" % (np.dtype(dtype).name, obs.window.nbytes / 2**20) +
+              "".join(" %7.3f s/s " % (t / length) for t in times))
+
+
+def benchmark_cleaner_dtypes(length=0.5, dtypes=(np.float32, np.uint8), tolerance=0.1):
+    """Check that the cleaners flag as many samples of the same noise whatever its data type."""
+    rfim = RFIm()
+    functions = {'tdsc_amber': rfim.tdsc_amber,
+                 'fdsc_amber': rfim.fdsc_amber,
+                 'running_time': lambda data: StreamingTimeCleaner(data.shape[0])(data),
+                 'running_frequency': lambda data: StreamingFrequencyCleaner(data.shape[0])(data)}
+    print("%-18s" % "flagged" + "".join("%10s" % np.dtype(dtype).name for dtype in dtypes))
+    failed = []
+    for name, function in functions.items():
+        fractions = []
+        for dtype in dtypes:
+            obs = Observation(Backend(), length=length, seed=0, dtype=dtype)
+            fractions.append((function(obs.window.copy()) != obs.window).mean())
+        print("%-18s" % name + "".join("%9.4f%%" % (100 * f) for f in fractions))
+        if np.ptp(fractions) > tolerance * max(fractions):
+            failed.append(name)
+    if failed:
+        raise AssertionError("Flagged fractions depend on the data type: %s" % ", ".join(failed))
+
+
+def benchmark_injection(length=2, n_pulses=(1, 10, 100, 1000), repeats=3):
+    """Compare injecting pulses one at a time to Observation.add_dispersed_pulses on a full size ARTS window."""
+    obs = Observation(Backend(), length=length, seed=0)
+    rng = np.random.default_rng(0)
+    print("window %s" % (obs.window.shape,))
+    print("%-8s %12s %12s %9s" % ("pulses", "one by one", "batched", "speedup"))
+    for n in n_pulses:
+        pulses = (rng.uniform(0, 1000, n), rng.uniform(0.001, 0.01, n), rng.uniform(0, length, n), rng.uniform(10, 100, n))
+
+        def one_by_one(data):
+            obs.window = data
+            for dm, width, pulse_t0, snr in zip(*pulses):
+                t_idx = obs.time_to_index(pulse_t0) + obs.delay_plan(dm).shifts[0]
+                value = obs.snr(snr, np.sqrt(obs.backend.n_channels*width/obs.backend.sampling_time))
+                for i in range(t_idx.shape[0]):
+                    obs.add_signal(value, i, i+1, t_idx[i], t_idx[i]+obs.time_to_index(obs.t0 + width))
+
+        def batched(data):
+            obs.window = data
+            obs.add_dispersed_pulses(*pulses)
+
+        window = obs.window
+        reference_time, reference = _best_time(one_by_one, window, repeats)
+        batched_time, result = _best_time(batched, window, repeats)
+        obs.window = window
+        print("%-8d %10.3f s %10.3f s %9.2f  (max difference %.1e)" % (n, reference_time, batched_time,
+                                                                      reference_time / batched_time,
+                                                                      np.abs(result - reference).max()))
+
+
+def benchmark_pulse_profiles(dms=(100, 500, 1000), scattering_times=(0.001, 0.01), repeats=3):
+    """Compare per-channel convolution to the batched FFT convolution of Pulse.profiles for the ARTS band."""
+    backend = Backend()
+    print("%-8s %10s %14s %12s %9s" % ("dm", "scattering", "per channel", "batched", "speedup"))
+    for scattering_time in scattering_times:
+        pulse = Pulse(backend, width=0.002, profile='gaussian', scattering_time=scattering_time)
+        for dm in dms:
+            def per_channel(_):
+                # Same sampled components as Pulse.profiles, convolved one channel at a time
+                profiles = np.zeros((backend.n_channels, 1))
+                for i in range(backend.n_channels):
+                    channel = Pulse(Backend(n_channels=1, channel_bandwidth=backend.channel_bandwidth,
+                                            fmin=backend.frequencies[i]),
+                                    width=pulse.width, profile=pulse.profile, scattering_time=pulse.scattering_time,
+                                    reference_frequency=pulse.reference_frequency)
+                    profiles[i, 0] = channel.profiles(dm)[0][0].max()
+                return profiles
+
+            reference_time, _ = _best_time(per_channel, np.zeros(1), repeats)
+            batched_time, _ = _best_time(lambda _: pulse.profiles(dm), np.zeros(1), repeats)
+            print("%-8d %9.3fs %12.3f s %10.3f s %9.2f" % (dm, scattering_time, reference_time, batched_time,
+                                                         reference_time / batched_time))
+
+
+def benchmark_campaign_snr(directory, n_windows=4, pulses_per_window=4, n_workers=1, tolerance=0.1):
+    """Check that a campaign recovers the S/N it injects, for bright unsmeared pulses of a searched width."""
+    backend = Backend()
+    # 8 samples wide (a searched boxcar), at DMs smearing them by less than a sample between trials
+    width = 8 * backend.sampling_time
+    population = Population(dm_range=(0, 2), width_range=(0.999 * width, width), fluence_range=(2, 4), sensitivity=10)
+    campaign = Campaign(backend, population, directory, n_windows=n_windows, pulses_per_window=pulses_per_window,
+                        dms=np.linspace(0, 2, 41), cleaning=())
+    start_time = time.perf_counter()
+    results = campaign.run(n_workers=n_workers)
+    ratios = results['recovered_snr'] / results['snr']
+    print("%d pulses in %.3f s, detected %d, recovered/injected S/N median %.3f (min %.3f, max %.3f)" %
+          (len(results), time.perf_counter() - start_time, results['detected'].sum(),
+           np.median(ratios), ratios.min(), ratios.max()))
+    if not results['detected'].all() or abs(np.median(ratios) - 1) > tolerance:
+        raise AssertionError("Recovered S/N differs from the injected S/N")
@@ -2,6 +2,7 @@
 from time_domain_astronomy_sandbox.backend import Backend
 from time_domain_astronomy_sandbox.observation import Observation
 from time_domain_astronomy_sandbox.pulse import Pulse
+from time_domain_astronomy_sandbox.rfim import RFIm
 from time_domain_astronomy_sandbox.plotting import plot_multi_images
 from matplotlib import rc
 
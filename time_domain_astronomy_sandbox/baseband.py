@@ -0,0 +1,225 @@
+"""Baseband and CoherentDedispersion classes."""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from .backend import Backend
+from .pulse import DM_CONSTANT
+
+
+class CoherentDedispersion():
+    """CoherentDedispersion class. Coherent (de)dispersion of complex voltages."""
+
+    def __init__(self,
+                 backend:Backend,
+                 dm:float,
+                 n_fft:int = None,
+                 blocks_per_batch:int = 64
+                ):
+        """Initialise CoherentDedispersion class.
+
+        The dispersion chirp of the band is computed once for the FFT length and
+        reused for every block, and blocks are transformed in batches.
+
+        Parameters
+        ----------
+        backend : Backend
+            An instance of Backend class, whose band (fmin to fmax) is complex-sampled
+        dm : float
+            Dispersion measure
+        n_fft : int
+            FFT length of the overlap-save blocks (default: the power of two of at
+            least four times the dispersion sweep, and at least 4096)
+        blocks_per_batch : int
+            Number of overlap-save blocks transformed together (default: 64)
+
+        """
+        self.backend = backend
+        self.dm = dm
+        self.bandwidth = backend.n_channels * backend.channel_bandwidth  # MHz
+        self.center_frequency = backend.fmin + self.bandwidth / 2  # MHz
+        self.blocks_per_batch = blocks_per_batch
+
+        # Dispersion sweep across the band (in samples) is the overlap between blocks
+        self.n_overlap = int(np.ceil(DM_CONSTANT * dm * (backend.fmin**-2 - backend.fmax**-2)
+                                     * self.bandwidth * 1e6))
+        if n_fft is None:
+            n_fft = max(4096, 1 << int(np.ceil(np.log2(4 * max(self.n_overlap, 1)))))
+        if n_fft <= self.n_overlap:
+            raise ValueError("n_fft (%d) must exceed the dispersion sweep (%d samples)" % (n_fft, self.n_overlap))
+        self.n_fft = n_fft
+        self.step = n_fft - self.n_overlap
+
+        # Phase (in cycles, with frequencies in MHz and delays in microseconds) whose
+        # group delay is Pulse.dt, i.e. relative to fmax
+        frequencies = self.center_frequency + np.fft.fftfreq(n_fft, d=1 / self.bandwidth)
+        phase = DM_CONSTANT * 1e6 * dm * (frequencies - backend.fmax)**2 / (frequencies * backend.fmax**2)
+        self.chirp = np.exp(2j * np.pi * phase)
+
+    def _overlap_save(self, voltages, chirp, causal):
+        n_samples = voltages.shape[0]
+        n_blocks = int(np.ceil(n_samples / self.step))
+        # Causal filters need the past sweep, anti-causal ones the future sweep
+        padded = np.zeros(n_blocks * self.step + self.n_overlap, dtype=np.complex128)
+        if causal:
+            padded[self.n_overlap:self.n_overlap + n_samples] = voltages
+            valid = slice(self.n_overlap, self.n_fft)
+        else:
+            padded[:n_samples] = voltages
+            valid = slice(0, self.step)
+
+        blocks = as_strided(padded,
+                            shape=(n_blocks, self.n_fft),
+                            strides=(self.step * padded.strides[0], padded.strides[0]),
+                            writeable=False)
+        output = np.empty((n_blocks, self.step), dtype=np.complex128)
+        for start in range(0, n_blocks, self.blocks_per_batch):
+            stop = min(start + self.blocks_per_batch, n_blocks)
+            output[start:stop] = np.fft.ifft(np.fft.fft(blocks[start:stop], axis=1) * chirp, axis=1)[:, valid]
+
+        return output.ravel()[:n_samples]
+
+    def dedisperse(self, voltages):
+        """Coherently dedisperse complex voltages.
+
+        Parameters
+        ----------
+        voltages : Numpy.Array
+            1D complex Array of baseband samples
+
+        Returns
+        -------
+        voltages : Numpy.Array
+            Dedispersed voltages. The last n_overlap samples lack the data following
+            the end of the input.
+
+        """
+        return self._overlap_save(voltages, self.chirp.conj(), causal=False)
+
+    def disperse(self, voltages):
+        """Coherently disperse complex voltages (delays follow Pulse.dt).
+
+        Parameters
+        ----------
+        voltages : Numpy.Array
+            1D complex Array of baseband samples
+
+        Returns
+        -------
+        voltages : Numpy.Array
+            Dispersed voltages
+
+        """
+        return self._overlap_save(voltages, self.chirp, causal=True)
+
+
+class Baseband():
+    """Baseband class. Complex voltages of a Backend's band, before channelisation."""
+
+    def __init__(self,
+                 backend:Backend,
+                 length:float = 0.01, # length in second
+                 t0:float = 0.
+                ):
+        """Initialise Baseband class.
+
+        Parameters
+        ----------
+        backend : Backend
+            An instance of Backend class. Its band (fmin to fmax) is complex-sampled
+            at the bandwidth.
+        length : float
+            Length of the observation (in second)
+        t0 : float
+            Starting time of the observation (in second)
+
+        """
+        self.backend = backend
+        self.length = length
+        self.t0 = t0
+        self.bandwidth = backend.n_channels * backend.channel_bandwidth  # MHz
+        self.sampling_time = 1 / (self.bandwidth * 1e6)  # second
+
+        n_samples = int(self.length / self.sampling_time)
+        self.voltages = (np.random.normal(0, 1, n_samples) + 1j * np.random.normal(0, 1, n_samples)) / np.sqrt(2)
+
+        self.time_to_index = lambda t_i : np.ceil((t_i-self.t0)/self.sampling_time).astype(int)
+
+    def add_dispersed_pulse(self, dm, width, pulse_t0, snr=100, n_fft=None):
+        """Add a coherently dispersed pulse.
+
+        The pulse is a burst of complex gaussian noise (as emitted by a pulsar or an
+        FRB) with a boxcar envelope, dispersed with CoherentDedispersion.
+
+        Parameters
+        ----------
+        dm : float
+            Dispersion measure of the pulse
+        width : float
+            Intrinsic width of the pulse (in second)
+        pulse_t0 : float
+            Arrival time of the pulse at fmax (in second)
+        snr : float
+            Signal-to-noise ratio of the pulse, once channelised and integrated over its width
+        n_fft : int
+            FFT length of the overlap-save blocks (default: see CoherentDedispersion)
+
+        """
+        start = self.time_to_index(pulse_t0)
+        n_width = max(1, int(self.time_to_index(self.t0 + width)))
+        n_samples = self.voltages.shape[0]
+        if start >= n_samples:
+            return
+
+        n_width = min(n_width, n_samples - start)
+        burst = np.zeros(n_samples, dtype=np.complex128)
+        burst[start:start + n_width] = (np.random.normal(0, 1, n_width) + 1j * np.random.normal(0, 1, n_width)) / np.sqrt(2)
+        # Mean power of the burst relative to the unit noise power
+        burst *= np.sqrt(snr / np.sqrt(n_width))
+        self.voltages += CoherentDedispersion(self.backend, dm, n_fft=n_fft).disperse(burst)
+
+    def dedisperse(self, dm, n_fft=None):
+        """Coherently dedisperse the voltages.
+
+        Parameters
+        ----------
+        dm : float
+            Dispersion measure to use for dedispersion
+        n_fft : int
+            FFT length of the overlap-save blocks (default: see CoherentDedispersion)
+
+        Returns
+        -------
+        voltages : Numpy.Array
+            The dedispersed voltages.
+
+        """
+        return CoherentDedispersion(self.backend, dm, n_fft=n_fft).dedisperse(self.voltages)
+
+    def channelise(self, voltages=None, n_integrate=None):
+        """Channelise voltages into a filterbank of the Backend's channels.
+
+        Parameters
+        ----------
+        voltages : Numpy.Array
+            Complex voltages to channelise (default: self.voltages)
+        n_integrate : int
+            Number of spectra averaged per output sample (default: the number matching
+            backend.sampling_time)
+
+        Returns
+        -------
+        window : Numpy.Array
+            Power per channel and time sample (n_channels, n_samples), channel c
+            centred on backend.frequencies[c]
+
+        """
+        if voltages is None:
+            voltages = self.voltages
+        n_channels = self.backend.n_channels
+        if n_integrate is None:
+            n_integrate = max(1, int(round(self.backend.sampling_time / (n_channels * self.sampling_time))))
+
+        n_spectra = voltages.shape[0] // (n_channels * n_integrate) * n_integrate
+        spectra = np.fft.fftshift(np.fft.fft(voltages[:n_spectra * n_channels].reshape(n_spectra, n_channels),
+                                             axis=1), axes=1)
+        power = (np.abs(spectra)**2 / n_channels).reshape(-1, n_integrate, n_channels).mean(axis=1)
+        return power.T
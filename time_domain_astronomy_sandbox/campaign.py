@@ -0,0 +1,299 @@
+"""Population and Campaign classes."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .backend import Backend
+from .observation import Observation
+from .rfim import RFIm
+from .multibeam import _backend_parameters
+
+
+class Population():
+    """Population class. Distributions of the parameters of a population of pulses."""
+
+    dtype = np.dtype([('dm', np.float64),
+                      ('width', np.float64),  # second
+                      ('fluence', np.float64),  # Jy ms
+                      ('spectral_index', np.float64),
+                      ('snr', np.float64)])  # matched boxcar S/N
+
+    def __init__(self,
+                 dm_range=(50., 1000.),
+                 width_range=(0.0005, 0.01),
+                 fluence_range=(1., 100.),
+                 fluence_index:float = -1.5,
+                 spectral_index=(0., 0.),
+                 sensitivity:float = 1.
+                ):
+        """Initialise Population class.
+
+        DMs are uniform and widths log-uniform over their ranges. Fluences follow a
+        power law N(>F) ~ F**fluence_index (-1.5 for a non-evolving population in
+        Euclidean space) and spectral indices a normal distribution. The S/N of a
+        pulse follows the radiometer equation: it is sensitivity times its fluence
+        (in Jy ms), divided by the square root of its width (in ms). It is the S/N
+        of the pulse through its matched boxcar, across the band, as injected by
+        Campaign.
+
+        Parameters
+        ----------
+        dm_range : tuple
+            (min, max) dispersion measure
+        width_range : tuple
+            (min, max) width (in second)
+        fluence_range : tuple
+            (min, max) fluence (in Jy ms)
+        fluence_index : float
+            Index of the cumulative fluence distribution (default: -1.5)
+        spectral_index : tuple
+            (mean, standard deviation) of the spectral index (default: flat spectra)
+        sensitivity : float
+            S/N of a 1 Jy ms, 1 ms pulse
+
+        """
+        self.dm_range = dm_range
+        self.width_range = width_range
+        self.fluence_range = fluence_range
+        self.fluence_index = fluence_index
+        self.spectral_index = spectral_index
+        self.sensitivity = sensitivity
+
+    def draw(self, n_pulses, rng):
+        """Draw pulses from the population.
+
+        Parameters
+        ----------
+        n_pulses : int
+            Number of pulses
+        rng : Numpy.random.Generator
+            Random number generator
+
+        Returns
+        -------
+        pulses : Numpy.Array
+            Structured array with the fields of Population.dtype
+
+        """
+        pulses = np.zeros(n_pulses, dtype=self.dtype)
+        pulses['dm'] = rng.uniform(*self.dm_range, n_pulses)
+        pulses['width'] = np.exp(rng.uniform(*np.log(self.width_range), n_pulses))
+
+        # Inverse of the cumulative distribution of the power law
+        low, high = np.power(self.fluence_range, self.fluence_index)
+        pulses['fluence'] = (low + rng.uniform(0, 1, n_pulses) * (high - low))**(1 / self.fluence_index)
+        pulses['spectral_index'] = rng.normal(*self.spectral_index, n_pulses)
+        pulses['snr'] = self.sensitivity * pulses['fluence'] / np.sqrt(pulses['width'] / 1e-3)
+        return pulses
+
+
+def _run_window(window, backend_parameters, population, seed_sequence, length, pulses_per_window, dtype,
+                cleaning, dms, kwargs, filename):
+    # Everything random in a window derives from its own seed sequence, so that a
+    # window gives the same result whichever worker runs it, and whenever
+    noise_sequence, pulse_sequence = seed_sequence.spawn(2)
+    rng = np.random.default_rng(pulse_sequence)
+    observation = Observation(Backend(*backend_parameters), length=length, dtype=dtype,
+                              seed=int(noise_sequence.generate_state(1, np.uint64)[0]))
+
+    pulses = population.draw(pulses_per_window, rng)
+    # One pulse per equal slot of the window, swept across the band within it if it fits
+    sweeps = observation.delay_plan(pulses['dm']).shifts.max(axis=1) * observation.backend.sampling_time
+    slot = length / pulses_per_window
+    margins = np.maximum(slot - sweeps - pulses['width'], 0)
+    t0s = np.arange(pulses_per_window) * slot + rng.uniform(0, 1, pulses_per_window) * margins
+    observation.add_dispersed_pulses(pulses['dm'], pulses['width'], t0s, pulses['snr'],
+                                     spectral_indices=pulses['spectral_index'], matched=True)
+
+    rfim = RFIm()
+    steps = {'dm0': rfim.dm0clean, 'time': rfim.tdsc_amber, 'frequency': rfim.fdsc_amber,
+             'kurtosis': rfim.spectral_kurtosis}
+    for step in cleaning:
+        steps[step](observation.window)
+    candidates = observation.search(dms, **kwargs)
+
+    table = np.zeros(pulses_per_window, dtype=Campaign.dtype)
+    for name in Population.dtype.names:
+        table[name] = pulses[name]
+    table['window'] = window
+    table['pulse'] = np.arange(pulses_per_window)
+    table['t0'] = t0s
+    # The brightest candidate starting within a boxcar of the arrival time recovers a pulse
+    sampling_time = observation.backend.sampling_time
+    for i in range(pulses_per_window):
+        tolerance = max(pulses['width'][i], sampling_time) + max(kwargs.get('widths', [128])) * sampling_time
+        close = np.nonzero(np.abs(candidates['time'] - t0s[i]) <= tolerance)[0]
+        if len(close):
+            best = close[np.argmax(candidates['snr'][close])]
+            table['detected'][i] = True
+            for name in ('time', 'dm', 'width', 'snr'):
+                table['recovered_' + name][i] = candidates[name][best]
+
+    # Written under a temporary name and renamed, so that only complete windows count
+    with open(filename + '.part', 'wb') as f:
+        np.savez(f, **{name: table[name] for name in table.dtype.names})
+    os.replace(filename + '.part', filename)
+    return table
+
+
+class Campaign():
+    """Campaign class. Injection and recovery of a population of pulses in many observations."""
+
+    dtype = np.dtype([('window', np.int64),
+                      ('pulse', np.int32),
+                      ('t0', np.float64),  # second
+                      *Population.dtype.descr,
+                      ('detected', np.bool_),
+                      ('recovered_time', np.float64),  # second
+                      ('recovered_dm', np.float64),
+                      ('recovered_width', np.int32),  # samples
+                      ('recovered_snr', np.float32)])
+
+    def __init__(self,
+                 backend:Backend,
+                 population:Population,
+                 directory:str,
+                 n_windows:int,
+                 pulses_per_window:int = 1,
+                 length:float = 1,
+                 dms=None,
+                 cleaning=('time', 'frequency'),
+                 seed:int = 0,
+                 dtype=np.float64,
+                 **kwargs
+                ):
+        """Initialise Campaign class.
+
+        Each window is an Observation with its own procedural noise, into which
+        pulses drawn from the population are injected, which is then cleaned and
+        searched. Injected and recovered parameters of every pulse are written to
+        one columnar .npz file per window in directory, so that a campaign that is
+        interrupted resumes where it stopped, and windows run on a pool of worker
+        processes. Window i draws all its random numbers from the i-th child of
+        np.random.SeedSequence(seed): results only depend on the seed, not on the
+        number of workers or on the order in which windows run.
+
+        Parameters
+        ----------
+        backend : Backend
+            An instance of Backend class
+        population : Population
+            Population the pulses are drawn from
+        directory : str
+            Directory of the result files (created if needed)
+        n_windows : int
+            Number of observation windows
+        pulses_per_window : int
+            Number of pulses injected in each window (default: 1)
+        length : float
+            Length of each window (in second)
+        dms : (list | Numpy.array)
+            Dispersion measures to search (default: 64 trials over the DM range of the population)
+        cleaning : list
+            RFI mitigation steps applied to each window before the search, in order:
+            'dm0', 'time', 'frequency', 'kurtosis' (default: ('time', 'frequency'))
+        seed : int
+            Seed of the campaign
+        dtype : Numpy.dtype
+            Data type of the windows
+        **kwargs
+            Extra arguments for Observation.search (widths, threshold, method, ...)
+
+        """
+        self.backend = backend
+        self.population = population
+        self.directory = directory
+        self.n_windows = n_windows
+        self.pulses_per_window = pulses_per_window
+        self.length = length
+        self.dms = np.linspace(0, 1.1 * population.dm_range[1], 64) if dms is None else np.atleast_1d(dms)
+        self.cleaning = tuple(cleaning)
+        self.seed = seed
+        self.window_dtype = np.dtype(dtype)
+        self.kwargs = kwargs
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, window):
+        """Result file of a window."""
+        return os.path.join(self.directory, "window_%06d.npz" % window)
+
+    def pending(self):
+        """Windows without a result file yet."""
+        return [i for i in range(self.n_windows) if not os.path.exists(self.filename(i))]
+
+    def run(self, n_workers=None):
+        """Run the windows without results, one window per worker process at a time.
+
+        Parameters
+        ----------
+        n_workers : int
+            Number of worker processes (default: the number of CPUs; 1 runs in this process)
+
+        Returns
+        -------
+        results : Numpy.Array
+            Results of all windows run so far, see results()
+
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        sequences = np.random.SeedSequence(self.seed).spawn(self.n_windows)
+        arguments = lambda window: (window, _backend_parameters(self.backend), self.population, sequences[window],
+                                    self.length, self.pulses_per_window, self.window_dtype, self.cleaning,
+                                    self.dms, self.kwargs, self.filename(window))
+
+        pending = self.pending()
+        if n_workers == 1 or len(pending) < 2:
+            for window in pending:
+                _run_window(*arguments(window))
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_workers, len(pending))) as pool:
+                futures = [pool.submit(_run_window, *arguments(window)) for window in pending]
+                for future in futures:
+                    future.result()
+        return self.results()
+
+    def results(self):
+        """Injected and recovered parameters of the pulses of every completed window.
+
+        Returns
+        -------
+        results : Numpy.Array
+            Structured array with the fields of Campaign.dtype, one row per pulse,
+            sorted by window
+
+        """
+        tables = []
+        for window in range(self.n_windows):
+            if os.path.exists(self.filename(window)):
+                with np.load(self.filename(window)) as columns:
+                    table = np.zeros(len(columns['window']), dtype=self.dtype)
+                    for name in self.dtype.names:
+                        table[name] = columns[name]
+                    tables.append(table)
+        return np.concatenate(tables + [np.zeros(0, dtype=self.dtype)])
+
+    @staticmethod
+    def completeness(results, column='fluence', bins=10):
+        """Fraction of the injected pulses that are detected, as a function of a parameter.
+
+        Parameters
+        ----------
+        results : Numpy.Array
+            Results of a campaign, see results()
+        column : str
+            Injected parameter (default: 'fluence')
+        bins : (int | Numpy.Array)
+            Number of bins or bin edges, as for np.histogram
+
+        Returns
+        -------
+        edges : Numpy.Array
+            Bin edges
+        completeness : Numpy.Array
+            Fraction of the pulses of each bin that are detected (nan for empty bins)
+
+        """
+        injected, edges = np.histogram(results[column], bins=bins)
+        detected, _ = np.histogram(results[column][results['detected']], bins=edges)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return edges, detected / injected
@@ -0,0 +1,199 @@
+"""Candidates class."""
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+class Candidates():
+    """Candidates class. A columnar table of single-pulse candidates."""
+
+    dtype = np.dtype([('time', np.float64),  # second
+                      ('sample', np.int64),
+                      ('dm', np.float64),
+                      ('width', np.int32),  # samples
+                      ('snr', np.float32),
+                      ('members', np.int32),
+                      ('beam', np.int32)])
+
+    def __init__(self, table=None):
+        """Initialise Candidates class.
+
+        Parameters
+        ----------
+        table : Numpy.Array
+            Structured array with the fields of Candidates.dtype (default: empty table)
+
+        """
+        self.table = np.zeros(0, dtype=self.dtype) if table is None else np.asarray(table, dtype=self.dtype)
+
+    @classmethod
+    def from_snr(cls, snr, dms, widths, threshold, width_index=None, sampling_time=1., t0=0.):
+        """Create the candidates of S/N above a threshold.
+
+        Parameters
+        ----------
+        snr : Numpy.Array
+            Either the S/N per width (n_widths, n_dm, n_samples), as from SNR.boxcar_snr,
+            or the best S/N (n_dm, n_samples) with its width_index, as from SNR.boxcar_peak
+        dms : (list | Numpy.Array)
+            Dispersion measure of each row
+        widths : (list | Numpy.Array)
+            Boxcar widths (in samples)
+        threshold : float
+            Detection threshold on S/N
+        width_index : Numpy.Array
+            Index in widths of each S/N, if snr is a best S/N
+        sampling_time : float
+            Sampling time (in second) (default: 1, i.e. times in samples)
+        t0 : float
+            Time of the first sample (in second) (default: 0)
+
+        Returns
+        -------
+        candidates : Candidates
+            One candidate per sample above threshold
+
+        """
+        dms = np.asarray(dms)
+        widths = np.asarray(widths)
+        if width_index is None:
+            w, d, t = np.nonzero(snr > threshold)
+            values = snr[w, d, t]
+        else:
+            d, t = np.nonzero(snr > threshold)
+            w = width_index[d, t]
+            values = snr[d, t]
+
+        table = np.zeros(len(t), dtype=cls.dtype)
+        table['time'] = t0 + t * sampling_time
+        table['sample'] = t
+        table['dm'] = dms[d]
+        table['width'] = widths[w]
+        table['snr'] = values
+        table['members'] = 1
+        return cls(table)
+
+    @classmethod
+    def concatenate(cls, candidates):
+        """Concatenate several tables of candidates.
+
+        Parameters
+        ----------
+        candidates : list
+            List of Candidates
+
+        Returns
+        -------
+        candidates : Candidates
+            A single table
+
+        """
+        return cls(np.concatenate([c.table for c in candidates] + [np.zeros(0, dtype=cls.dtype)]))
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.table[key]
+        return Candidates(np.atleast_1d(self.table[key]))
+
+    def __repr__(self):
+        return "Candidates(%d)" % len(self)
+
+    def cluster(self, time_radius, dm_radius, width_radius=1.):
+        """Merge neighbouring candidates into one candidate per event (friends-of-friends).
+
+        Candidates are binned on a grid whose cells are time_radius long in time,
+        dm_radius in DM and width_radius in log2(width). Candidates sharing a cell
+        are friends, and so are candidates of adjacent occupied cells, which a
+        KD-tree over the occupied cells finds. Clusters are the connected groups of
+        friends. The cost grows linearly with the number of candidates, however
+        dense a cluster is.
+
+        Parameters
+        ----------
+        time_radius : float
+            Linking length in time (in the unit of the time column)
+        dm_radius : float
+            Linking length in DM
+        width_radius : float
+            Linking length in log2 of the width (default: 1, i.e. adjacent powers of two)
+
+        Returns
+        -------
+        candidates : Candidates
+            The highest S/N candidate of each cluster, with members set to the
+            number of candidates it merges, sorted by time
+
+        """
+        if len(self) == 0:
+            return Candidates(self.table.copy())
+
+        n_clusters, labels = self.cluster_labels(time_radius, dm_radius, width_radius)
+
+        # Brightest member of each cluster: last of its cluster once sorted by S/N
+        order = np.lexsort((self.table['snr'], labels))
+        last = np.append(np.nonzero(np.diff(labels[order]))[0], len(order) - 1)
+        table = self.table[order[last]].copy()
+        table['members'] = np.bincount(labels, weights=self.table['members'], minlength=n_clusters)
+        return Candidates(table[np.argsort(table['time'], kind='stable')])
+
+    def cluster_labels(self, time_radius, dm_radius, width_radius=1.):
+        """Cluster of each candidate (friends-of-friends, see cluster).
+
+        Parameters
+        ----------
+        time_radius : float
+            Linking length in time (in the unit of the time column)
+        dm_radius : float
+            Linking length in DM
+        width_radius : float
+            Linking length in log2 of the width (default: 1, i.e. adjacent powers of two)
+
+        Returns
+        -------
+        n_clusters : int
+            Number of clusters
+        labels : Numpy.Array
+            Index of the cluster of each candidate
+
+        """
+        if len(self) == 0:
+            return 0, np.zeros(0, dtype=int)
+
+        points = np.column_stack((self.table['time'] / time_radius,
+                                  self.table['dm'] / dm_radius,
+                                  np.log2(np.maximum(self.table['width'], 1)) / width_radius))
+        cells, cell_of_candidate = np.unique(np.floor(points).astype(np.int64), axis=0, return_inverse=True)
+        cell_of_candidate = cell_of_candidate.ravel()
+        pairs = cKDTree(cells).query_pairs(r=1., p=np.inf, output_type='ndarray')
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(cells), len(cells)))
+        n_clusters, cell_labels = connected_components(graph, directed=False)
+        return n_clusters, cell_labels[cell_of_candidate]
+
+    def sift(self, min_snr=None, min_members=1, dm_range=None):
+        """Select candidates.
+
+        Parameters
+        ----------
+        min_snr : float
+            Smallest S/N kept (default: keep all)
+        min_members : int
+            Smallest number of merged candidates kept (default: 1)
+        dm_range : tuple
+            (min, max) DM kept (default: keep all)
+
+        Returns
+        -------
+        candidates : Candidates
+            The selected candidates
+
+        """
+        keep = self.table['members'] >= min_members
+        if min_snr is not None:
+            keep &= self.table['snr'] >= min_snr
+        if dm_range is not None:
+            keep &= (self.table['dm'] >= dm_range[0]) & (self.table['dm'] <= dm_range[1])
+        return Candidates(self.table[keep])
@@ -0,0 +1,150 @@
+"""DDPlan class."""
+import numpy as np
+from .backend import Backend
+from .pulse import DM_CONSTANT
+
+
+class DDPlan():
+    """DDPlan class. Smearing-aware plan of DM trials and downsampling factors."""
+
+    def __init__(self,
+                 backend:Backend,
+                 max_dm:float,
+                 snr_loss:float = 0.1,
+                 width:float = 0.001, # second
+                 min_dm:float = 0.,
+                 max_downsample:int = 64
+                ):
+        """Initialise DDPlan class.
+
+        The effective width of a pulse at a given DM combines its intrinsic width,
+        the (downsampled) sampling time and the dispersion smearing within the lowest
+        channel, added in quadrature. S/N scales as the inverse square root of the
+        effective width, so the tolerable S/N loss sets both how far apart DM trials
+        can be (a pulse is at most half a step away from a trial) and how much the
+        data can be downsampled. Downsampling and the DM step each broaden pulses by
+        at most the square root of the tolerable broadening, so that together (the
+        step sweep being added to the downsampled width) they stay within it. Trials
+        are grouped into ranges of constant step and downsampling; a new range starts
+        when either could double.
+
+        Parameters
+        ----------
+        backend : Backend
+            An instance of Backend class
+        max_dm : float
+            Largest dispersion measure to search
+        snr_loss : float
+            Tolerable fractional S/N loss, both between DM trials and from downsampling,
+            strictly between 0 and 1 (default: 0.1)
+        width : float
+            Intrinsic pulse width (in second) (default: 0.001)
+        min_dm : float
+            Smallest dispersion measure to search (default: 0)
+        max_downsample : int
+            Largest downsampling factor, a power of two (default: 64)
+
+        """
+        if not 0 < snr_loss < 1:
+            raise ValueError("snr_loss must be strictly between 0 and 1, got %g" % snr_loss)
+        self.backend = backend
+        self.max_dm = max_dm
+        self.min_dm = min_dm
+        self.snr_loss = snr_loss
+        self.width = width
+        self.max_downsample = max_downsample
+
+        # Largest smearing ratio (smeared over unsmeared width) within the S/N loss
+        self.max_broadening = (1 - snr_loss)**-2
+        # Shared between downsampling and the DM step, which broaden one after the other
+        self.step_broadening = np.sqrt(self.max_broadening)
+        # Dispersion delay across the band, and within the lowest channel, per unit DM (in second)
+        self.band_sweep = DM_CONSTANT * (backend.fmin**-2 - backend.fmax**-2)
+        self.channel_sweep = DM_CONSTANT * (backend.fmin**-2 - (backend.fmin + backend.channel_bandwidth)**-2)
+
+        # Ranges of (first DM, end DM, DM step, downsampling factor)
+        self.ranges = []
+        dms, range_index = [], []
+        dm = min_dm
+        while dm <= max_dm:
+            downsample = self.downsampling_factor(dm)
+            step = self.dm_step(dm, downsample)
+            low = dm
+            while dm <= max_dm and self.downsampling_factor(dm) == downsample and self.dm_step(dm, downsample) < 2 * step:
+                dms.append(dm)
+                range_index.append(len(self.ranges))
+                dm += step
+            self.ranges.append((low, dm, step, downsample))
+
+        self.dms = np.array(dms)
+        self.range_index = np.array(range_index)
+        self.downsampling = np.array([self.ranges[i][3] for i in range_index], dtype=int)
+
+    def smearing(self, dm, downsample=1):
+        """Effective width of a pulse at a given DM.
+
+        Parameters
+        ----------
+        dm : (float | Numpy.array)
+            Dispersion measure
+        downsample : int
+            Downsampling factor of the data (default: 1)
+
+        Returns
+        -------
+        width : (float | Numpy.array)
+            Effective width (in second)
+
+        """
+        return np.sqrt(self.width**2 +
+                       (downsample * self.backend.sampling_time)**2 +
+                       (self.channel_sweep * dm)**2)
+
+    def downsampling_factor(self, dm):
+        """Largest power of two downsampling factor within its share of the S/N loss at a given DM.
+
+        Parameters
+        ----------
+        dm : float
+            Dispersion measure
+
+        Returns
+        -------
+        downsample : int
+            Downsampling factor
+
+        """
+        downsample = 1
+        while (2 * downsample <= self.max_downsample and
+               self.smearing(dm, 2 * downsample) <= self.step_broadening * self.smearing(dm)):
+            downsample *= 2
+        return downsample
+
+    def dm_step(self, dm, downsample=1):
+        """Largest DM step within its share of the S/N loss at a given DM.
+
+        Parameters
+        ----------
+        dm : float
+            Dispersion measure
+        downsample : int
+            Downsampling factor of the data (default: 1)
+
+        Returns
+        -------
+        step : float
+            Distance to the next DM trial
+
+        """
+        sweep = self.smearing(dm, downsample) * np.sqrt(self.step_broadening**2 - 1)
+        return 2 * sweep / self.band_sweep
+
+    @property
+    def n_trials(self):
+        """Number of DM trials of the plan."""
+        return len(self.dms)
+
+    @property
+    def n_uniform_trials(self):
+        """Number of DM trials of a uniform grid with the plan's smallest step."""
+        return int(np.ceil((self.max_dm - self.min_dm) / self.dm_step(self.min_dm))) + 1
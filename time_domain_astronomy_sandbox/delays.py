@@ -0,0 +1,113 @@
+"""DelayPlan class."""
+import threading
+from collections import OrderedDict
+import numpy as np
+from .backend import Backend
+from .pulse import Pulse
+
+
+class DelayPlan():
+    """DelayPlan class. Dispersion delays of a DM grid for every channel of a Backend."""
+
+    def __init__(self,
+                 backend:Backend,
+                 dms,
+                 sampling_time:float = None
+                ):
+        """Initialise DelayPlan class.
+
+        Use delay_plan() to get a cached instance rather than building it directly.
+
+        Parameters
+        ----------
+        backend : Backend
+            An instance of Backend class
+        dms : (list | Numpy.array)
+            Grid of dispersion measures
+        sampling_time : float
+            Sampling time used to convert delays into samples (default: backend.sampling_time)
+
+        """
+        self.backend = backend
+        self.sampling_time = backend.sampling_time if sampling_time is None else sampling_time
+        self.dms = np.atleast_1d(np.asarray(dms, dtype=float))
+
+        # Delays (in second) and delays in samples, both (n_dm, n_channels)
+        self.delays = Pulse(backend).delays(self.dms)
+        self.shifts = np.ceil(self.delays / self.sampling_time).astype(int)
+        self.max_shift = int(self.shifts.max()) if self.shifts.size else 0
+
+        for table in (self.dms, self.delays, self.shifts):
+            table.flags.writeable = False
+        self.nbytes = self.dms.nbytes + self.delays.nbytes + self.shifts.nbytes
+
+    def __len__(self):
+        return len(self.dms)
+
+
+# Total size (in bytes) of the plans kept by delay_plan
+CACHE_BUDGET = 2**28
+
+# Cached plans, least recently used first
+_plans = OrderedDict()
+_plans_nbytes = 0
+_plans_lock = threading.Lock()
+
+
+def _cached_delay_plan(n_channels, channel_bandwidth, fmin, sampling_time, dms):
+    global _plans_nbytes
+    key = (n_channels, channel_bandwidth, fmin, sampling_time, dms)
+    with _plans_lock:
+        if key in _plans:
+            _plans.move_to_end(key)
+            return _plans[key]
+
+    backend = Backend(n_channels=n_channels,
+                      channel_bandwidth=channel_bandwidth,
+                      fmin=fmin,
+                      sampling_time=sampling_time,
+                      samples_per_second=int(round(1 / sampling_time)))
+    plan = DelayPlan(backend, dms)
+    if plan.nbytes > CACHE_BUDGET:
+        return plan
+
+    with _plans_lock:
+        if key not in _plans:
+            _plans[key] = plan
+            _plans_nbytes += plan.nbytes
+        while _plans_nbytes > CACHE_BUDGET:
+            _, evicted = _plans.popitem(last=False)
+            _plans_nbytes -= evicted.nbytes
+        return _plans.get(key, plan)
+
+
+def delay_plan(backend, dms, sampling_time=None):
+    """Get the DelayPlan of a DM grid, computed once per backend and grid.
+
+    Plans are kept in a least-recently-used cache keyed on the backend channelisation,
+    the sampling time and the DM grid, so that repeated dedispersion or injection over
+    the same grid reuses the same (read-only) delay tables. The cache holds at most
+    CACHE_BUDGET bytes of tables, evicting the least recently used plans, so that many
+    single-DM plans (e.g. of injections) take the room of a single large grid. Plans
+    larger than the budget are recomputed at every call.
+
+    Parameters
+    ----------
+    backend : Backend
+        An instance of Backend class
+    dms : (float | list | Numpy.array)
+        Grid of dispersion measures
+    sampling_time : float
+        Sampling time used to convert delays into samples (default: backend.sampling_time)
+
+    Returns
+    -------
+    plan : DelayPlan
+        The delay plan of the grid
+
+    """
+    if sampling_time is None:
+        sampling_time = backend.sampling_time
+    dms = tuple(float(dm) for dm in np.atleast_1d(dms))
+    return _cached_delay_plan(backend.n_channels, backend.channel_bandwidth, backend.fmin,
+                              sampling_time, dms)
@@ -0,0 +1,73 @@
+"""Data type helpers."""
+import numpy as np
+
+
+def accumulation_dtype(dtype):
+    """Floating point type of the sums and statistics of data of a given type.
+
+    float64 data are accumulated in float64. Narrower floats and integers (e.g.
+    8-bit filterbank samples) are accumulated in float32, which neither overflows
+    nor loses the precision of the data over the sums of a window.
+
+    Parameters
+    ----------
+    dtype : Numpy.dtype
+        Data type of the data
+
+    Returns
+    -------
+    dtype : Numpy.dtype
+        float64 or float32
+
+    """
+    return np.dtype(np.float64) if np.dtype(dtype) == np.float64 else np.dtype(np.float32)
+
+
+def to_dtype(values, dtype):
+    """Cast values to a data type, rounded and clipped to its range for integer types.
+
+    Parameters
+    ----------
+    values : (float | Numpy.Array)
+        Values to cast
+    dtype : Numpy.dtype
+        Target data type
+
+    Returns
+    -------
+    values : Numpy.Array
+        The values in dtype (not copied if already in dtype)
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        return np.clip(np.rint(values), info.min, info.max).astype(dtype)
+    return np.asarray(values).astype(dtype, copy=False)
+
+
+def quantisation(dtype):
+    """Offset and scale of standard normal noise stored in a data type.
+
+    Floating point data hold noise as is (offset 0, scale 1). Integer data hold
+    offset + scale * noise, centred in the range of the type with 16 levels per
+    standard deviation for 8-bit data, as filterbank data are.
+
+    Parameters
+    ----------
+    dtype : Numpy.dtype
+        Data type
+
+    Returns
+    -------
+    offset : float
+        Value of the noise mean
+    scale : float
+        Number of levels per standard deviation of the noise
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        return (int(info.max) + int(info.min) + 1) / 2, (int(info.max) - int(info.min) + 1) / 16
+    return 0., 1.
@@ -0,0 +1,210 @@
+"""RFIMask class."""
+import numpy as np
+
+# Number of set bits of every byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _runs(flags):
+    """[start, stop) runs of True values of a 1D bool array, as an (n_runs, 2) array."""
+    edges = np.diff(np.concatenate(([0], flags.view(np.int8), [0])))
+    return np.column_stack((np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]))
+
+
+def _flags(runs, n):
+    """1D bool array of length n, True within the [start, stop) runs."""
+    edges = np.zeros(n + 1, dtype=np.int32)
+    np.add.at(edges, runs[:, 0], 1)
+    np.add.at(edges, runs[:, 1], -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+class RFIMask():
+    """RFIMask class. Compact mask of flagged samples of a (n_channels, n_samples) window.
+
+    Flagged channels and flagged time samples (whole rows and columns, as left by
+    narrow-band and broad-band RFI) are run-length encoded as [start, stop) runs.
+    Remaining flags are bit-packed with np.packbits, one bit per sample, and not
+    stored at all when there are none.
+    """
+
+    def __init__(self, shape):
+        """Initialise RFIMask class with no flagged sample.
+
+        Parameters
+        ----------
+        shape : tuple
+            Shape (n_channels, n_samples) of the masked window
+
+        """
+        self.shape = tuple(shape)
+        self.channel_runs = np.zeros((0, 2), dtype=np.int64)
+        self.time_runs = np.zeros((0, 2), dtype=np.int64)
+        self.bits = None
+
+    @classmethod
+    def from_bool(cls, mask):
+        """Create a mask from a boolean array.
+
+        Parameters
+        ----------
+        mask : Numpy.Array
+            2D bool Array (n_channels, n_samples), True where flagged
+
+        Returns
+        -------
+        mask : RFIMask
+            The compact mask
+
+        """
+        rfimask = cls(mask.shape)
+        rfimask.flag(mask)
+        return rfimask.compress()
+
+    def _bits(self):
+        if self.bits is None:
+            self.bits = np.zeros((self.shape[0], (self.shape[1] + 7) // 8), dtype=np.uint8)
+        return self.bits
+
+    def flag(self, block, channels=slice(None), start=0):
+        """Flag the True samples of a block of the window.
+
+        Parameters
+        ----------
+        block : Numpy.Array
+            2D bool Array (n_selected_channels, n_block_samples)
+        channels : slice
+            Channels of the block (default: all)
+        start : int
+            Time sample of the first column of the block (default: 0)
+
+        """
+        bits = self._bits()
+        first, stop = start // 8, (start + block.shape[1] + 7) // 8
+        if start % 8 == 0:
+            # The zero padding of the last byte leaves the following samples untouched
+            bits[channels, first:stop] |= np.packbits(block, axis=1)
+        else:
+            current = np.unpackbits(bits[channels, first:stop], axis=1)
+            current[:, start - 8 * first:start - 8 * first + block.shape[1]] |= block.astype(bool)
+            bits[channels, first:stop] = np.packbits(current, axis=1)
+
+    def flag_channels(self, channels):
+        """Flag whole channels.
+
+        Parameters
+        ----------
+        channels : (list | Numpy.Array)
+            Indices of the channels
+
+        """
+        flags = _flags(self.channel_runs, self.shape[0])
+        flags[channels] = True
+        self.channel_runs = _runs(flags)
+
+    def flag_samples(self, samples):
+        """Flag whole time samples (all channels).
+
+        Parameters
+        ----------
+        samples : (list | Numpy.Array)
+            Indices of the time samples
+
+        """
+        flags = _flags(self.time_runs, self.shape[1])
+        flags[samples] = True
+        self.time_runs = _runs(flags)
+
+    def compress(self):
+        """Move whole flagged channels and samples from the bits to runs, and drop empty bits.
+
+        Returns
+        -------
+        mask : RFIMask
+            The mask itself
+
+        """
+        if self.bits is None or self.bits.size == 0:
+            return self
+        n_channels, n_samples = self.shape
+        last = np.uint8(0xff << (8 * self.bits.shape[1] - n_samples) & 0xff)
+
+        full_channels = (self.bits[:, :-1] == 0xff).all(axis=1) & (self.bits[:, -1] & last == last)
+        if full_channels.any():
+            self.flag_channels(np.nonzero(full_channels)[0])
+        channel_flags = _flags(self.channel_runs, n_channels)
+        self.bits[channel_flags] = 0
+
+        if not channel_flags.all():
+            full_samples = np.bitwise_and.reduce(self.bits[~channel_flags], axis=0)
+            if full_samples.any():
+                self.flag_samples(np.nonzero(np.unpackbits(full_samples, count=n_samples))[0])
+        self.bits &= ~np.packbits(_flags(self.time_runs, n_samples))
+
+        if not self.bits.any():
+            self.bits = None
+        return self
+
+    def to_bool(self, start=0, stop=None, channels=slice(None)):
+        """Decode part of the mask.
+
+        Parameters
+        ----------
+        start : int
+            First time sample (default: 0)
+        stop : int
+            End time sample (default: n_samples)
+        channels : slice
+            Channels to decode (default: all)
+
+        Returns
+        -------
+        mask : Numpy.Array
+            2D bool Array (n_selected_channels, stop - start), True where flagged
+
+        """
+        if stop is None:
+            stop = self.shape[1]
+        rows = np.arange(self.shape[0])[channels]
+        if self.bits is None:
+            mask = np.zeros((len(rows), stop - start), dtype=bool)
+        else:
+            first = start // 8
+            mask = np.unpackbits(self.bits[rows, first:(stop + 7) // 8], axis=1)
+            mask = mask[:, start - 8 * first:stop - 8 * first].astype(bool)
+        mask[_flags(self.channel_runs, self.shape[0])[rows]] = True
+        mask[:, _flags(self.time_runs, self.shape[1])[start:stop]] = True
+        return mask
+
+    def __or__(self, other):
+        mask = RFIMask(self.shape)
+        if self.bits is not None or other.bits is not None:
+            mask.bits = self.bits.copy() if self.bits is not None else other.bits.copy()
+            if self.bits is not None and other.bits is not None:
+                mask.bits |= other.bits
+        mask.channel_runs = _runs(_flags(self.channel_runs, self.shape[0]) | _flags(other.channel_runs, self.shape[0]))
+        mask.time_runs = _runs(_flags(self.time_runs, self.shape[1]) | _flags(other.time_runs, self.shape[1]))
+        return mask.compress()
+
+    def __repr__(self):
+        return "RFIMask(shape=%s, occupancy=%.4f, nbytes=%d)" % (self.shape, self.occupancy, self.nbytes)
+
+    def channel_occupancy(self):
+        """Fraction of flagged samples per channel."""
+        n_channels, n_samples = self.shape
+        time_flags = _flags(self.time_runs, n_samples)
+        counts = np.full(n_channels, time_flags.sum(), dtype=np.int64)
+        if self.bits is not None:
+            counts += _POPCOUNT[self.bits & ~np.packbits(time_flags)].sum(axis=1, dtype=np.int64)
+        counts[_flags(self.channel_runs, n_channels)] = n_samples
+        return counts / n_samples
+
+    @property
+    def occupancy(self):
+        """Fraction of flagged samples."""
+        return float(self.channel_occupancy().mean()) if self.shape[1] else 0.
+
+    @property
+    def nbytes(self):
+        """Memory used by the mask (in bytes)."""
+        return self.channel_runs.nbytes + self.time_runs.nbytes + (0 if self.bits is None else self.bits.nbytes)
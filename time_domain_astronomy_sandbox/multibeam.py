@@ -0,0 +1,167 @@
+"""MultiBeamObservation class."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from .backend import Backend
+from .observation import Observation
+from .rfim import RFIm
+from .candidates import Candidates
+from .dtypes import quantisation, to_dtype
+
+def _backend_parameters(backend):
+    # Backend holds lambdas, so workers rebuild it rather than unpickle it
+    return (backend.n_channels, backend.channel_bandwidth, backend.fmin,
+            backend.sampling_time, backend.samples_per_second)
+
+
+def _search_beam(name, shape, dtype, backend_parameters, t0, beam, cleaning, dms, inplace, kwargs):
+    # The shared memory is attached for the task only, so that workers do not keep
+    # it mapped after the parent unlinks it
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return _search_window(np.ndarray(shape, dtype=dtype, buffer=shm.buf)[beam],
+                              backend_parameters, t0, beam, cleaning, dms, inplace, kwargs)
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # Views of a failed search are still referenced by its traceback; the
+            # mapping is closed when they are collected
+            pass
+
+
+def _search_window(window, backend_parameters, t0, beam, cleaning, dms, inplace, kwargs):
+    # Cleaning works on a private copy of the beam unless asked to clean it in place
+    window = window if inplace else window.copy()
+    observation = Observation(Backend(*backend_parameters), t0=t0, window=window, noise=quantisation(window.dtype))
+    rfim = RFIm()
+    steps = {'dm0': rfim.dm0clean, 'time': rfim.tdsc_amber, 'frequency': rfim.fdsc_amber,
+             'kurtosis': rfim.spectral_kurtosis}
+    for step in cleaning:
+        steps[step](observation.window)
+
+    candidates = observation.search(dms, **kwargs)
+    candidates.table['beam'] = beam
+    return candidates.table
+
+
+class MultiBeamObservation():
+    """MultiBeamObservation class. Simultaneous tied-array beams of a Backend in shared memory."""
+
+    def __init__(self,
+                 backend:Backend,
+                 n_beams:int,
+                 length:int = 1, # length in second
+                 t0:float = 0.,
+                 dtype=np.float64
+                ):
+        """Initialise MultiBeamObservation class.
+
+        The windows of all beams form one (n_beams, n_channels, n_samples) array in
+        a multiprocessing.shared_memory block, so that worker processes read them
+        there instead of receiving pickled copies (and clean them in place if asked
+        to, see search). Call close() (or
+        use the instance as a context manager) to release the block.
+
+        Parameters
+        ----------
+        backend : Backend
+            An instance of Backend class, shared by all beams
+        n_beams : int
+            Number of beams
+        length : int
+            Length of the observation (in second)
+        t0 : float
+            Starting time of the observation (in second)
+        dtype : Numpy.dtype
+            Data type of the windows
+
+        """
+        self.backend = backend
+        self.n_beams = n_beams
+        self.length = length
+        self.t0 = t0
+
+        shape = (n_beams, backend.n_channels, int(length * backend.samples_per_second))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+        self.windows = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        offset, scale = quantisation(dtype)
+        for window in self.windows:
+            window[:] = to_dtype(offset + scale * np.random.normal(0, 1, window.shape), dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.n_beams
+
+    def close(self):
+        """Release the shared memory block."""
+        if self.shm is not None:
+            del self.windows
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def beam(self, index):
+        """Observation of one beam.
+
+        Parameters
+        ----------
+        index : int
+            Index of the beam
+
+        Returns
+        -------
+        observation : Observation
+            Observation whose window is a view of the beam in shared memory, e.g. to
+            inject signals with add_dispersed_pulse or add_rfi
+
+        """
+        return Observation(self.backend, t0=self.t0, window=self.windows[index], noise=quantisation(self.windows.dtype))
+
+    def search(self, dms, cleaning=('time', 'frequency'), beams=None, n_workers=None, inplace=False, **kwargs):
+        """Clean, dedisperse and search every beam, one beam per worker process.
+
+        Parameters
+        ----------
+        dms : (list | Numpy.array)
+            Dispersion measures to search
+        cleaning : list
+            RFI mitigation steps applied to each beam before the search, in order:
+            'dm0', 'time', 'frequency', 'kurtosis' (default: ('time', 'frequency'))
+        beams : list of int
+            Beams to search (default: all)
+        n_workers : int
+            Number of worker processes (default: the number of CPUs)
+        inplace : bool
+            Clean the beams in shared memory, saving a copy of each beam per worker
+            but leaving them cleaned after the search (default: False, each worker
+            cleans a private copy and the beams are unchanged)
+        **kwargs
+            Extra arguments for Observation.search (widths, threshold, method, ...)
+
+        Returns
+        -------
+        candidates : Candidates
+            Candidates of all beams, with their beam column set, sorted by time
+
+        """
+        if beams is None:
+            beams = range(self.n_beams)
+        if n_workers is None:
+            n_workers = os.cpu_count()
+
+        arguments = (self.shm.name, self.windows.shape, self.windows.dtype,
+                     _backend_parameters(self.backend), self.t0)
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(beams))) as pool:
+            futures = [pool.submit(_search_beam, *arguments, beam, tuple(cleaning), np.atleast_1d(dms), inplace, kwargs)
+                       for beam in beams]
+            tables = [future.result() for future in futures]
+
+        table = np.concatenate(tables + [np.zeros(0, dtype=Candidates.dtype)])
+        return Candidates(table[np.argsort(table['time'], kind='stable')])
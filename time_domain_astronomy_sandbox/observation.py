@@ -1,20 +1,92 @@
 """Observation class."""
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from .backend import Backend
-from .pulse import Pulse
+from .pulse import Pulse, DM_CONSTANT
 from .rfim import RFIm
+from .mask import RFIMask
+from .streaming_rfim import StreamingTimeCleaner, StreamingFrequencyCleaner
+from .dedispersion import Dedispersion, ChunkedDedispersion
+from .delays import delay_plan
+from .snr import SNR
+from .candidates import Candidates
+from .dtypes import accumulation_dtype, to_dtype, quantisation
+
+
+def _prefetched(window, blocks, read=None):
+    """Copy blocks (index tuples) of a window into memory (or read them with read(block)), one block ahead of the consumer, from a thread."""
+    if read is None:
+        read = lambda block: np.array(window[block])
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        future = reader.submit(read, blocks[0]) if blocks else None
+        for i in range(len(blocks)):
+            chunk = future.result()
+            if i + 1 < len(blocks):
+                future = reader.submit(read, blocks[i + 1])
+            yield chunk
+
+
+def _written_behind(window, items):
+    """Write (block, values) items into a window from a thread, with at most one write in flight."""
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        write = None
+        for block, values in items:
+            # A disk slower than compute waits here, rather than queueing computed blocks in memory
+            if write is not None:
+                write.result()
+            write = writer.submit(window.__setitem__, block, values)
+        if write is not None:
+            write.result()
+
+
+def _map_blocks(function, window, blocks):
+    """Replace blocks of a window by a function of their in-memory copy, reading ahead and writing behind from threads."""
+    _written_behind(window, ((block, function(chunk)) for block, chunk in zip(blocks, _prefetched(window, blocks))))
 
 
 class Observation():
     """Observation class."""
 
+    # Tiles of procedural noise, each drawn from its own Philox stream
+    tile_channels = 64
+    tile_samples = 4096
+
     def __init__(self,
                  backend:Backend,
                  length:int = 1, # length in second
-                 t0:float = 0.
+                 t0:float = 0.,
+                 window:np.ndarray = None,
+                 filename:str = None,
+                 chunk_size:int = None, # samples
+                 seed:int = None,
+                 lazy:bool = False,
+                 dtype=np.float64,
+                 noise=None
                 ):
         """Initialise Observation class.
 
+        With a filename, the window is a np.memmap of that file rather than an array
+        in memory, so that observations larger than the memory can be simulated and
+        processed. An existing file is opened (its size sets the length), otherwise
+        it is created and filled with noise. time_cleaning, frequency_cleaning,
+        dedisperse and dedisperse_many then work through the map chunk by chunk,
+        reading the next chunk and writing the previous one from threads while
+        computing the current one.
+
+        With a seed, noise is procedural: each tile of tile_channels channels and
+        tile_samples samples is drawn from a Philox generator keyed by the seed, with
+        the tile index as counter, so any tile can be generated alone, reproducibly.
+        A lazy observation generates nothing upfront and keeps injected signals as a
+        list: generate() and iter_chunks() produce any part of the data on demand, in
+        memory proportional to the part, while using self.window generates (and
+        keeps) the whole window.
+
+        Data are stored in dtype: float types hold the noise as is, integer types
+        (e.g. uint8, as 8-bit filterbank data) hold offset + scale * noise, rounded
+        and clipped (see dtypes.quantisation). Injected signals are given in units
+        of the noise standard deviation either way.
+
         Parameters
         ----------
         backend : Backend
@@ -23,38 +95,336 @@ class Observation():
             Length of the observation (in second)
         t0 : float
             Starting time of the observation (in second)
+        window : Numpy.array
+            Existing data (n_channels, n_samples) to use, without copying it, instead
+            of generating noise. Its number of samples sets the length.
+        filename : str
+            File (of dtype, channel-major) backing the window as a np.memmap
+        chunk_size : int
+            Number of time samples per chunk of the out-of-core algorithms (default: samples_per_second)
+        seed : int
+            Seed of the procedural noise (default: noise from np.random.normal, or a
+            random seed if lazy)
+        lazy : bool
+            Generate the noise and injected signals only when they are used
+        dtype : Numpy.dtype
+            Data type of the window, e.g. np.float32, np.float16 or np.uint8 (default:
+            np.float64; the type of window if given)
+        noise : tuple
+            (median, standard deviation) of the noise of window, if known, rather than
+            measured on it (which sorts the window)
 
         """
         self.backend = backend
-        self.length = length
         self.t0 = t0
-        self.window = np.random.normal(0, 1, (self.backend.n_channels,
-                                              int(self.length*backend.samples_per_second)))
-        # self.window += np.abs(np.min(self.window))
-        self.noise_median = np.median(self.window).copy()
-        self.noise_std = np.std(self.window).copy()
+        self.chunk_size = backend.samples_per_second if chunk_size is None else chunk_size
+        if lazy and (window is not None or filename is not None):
+            raise ValueError("Lazy observations generate their own data, without window or filename")
+        if lazy and seed is None:
+            seed = int(np.random.SeedSequence().entropy)
+        self.seed = seed
+        self.signals = []
+        self._window = None
+
+        self.dtype = np.dtype(dtype if window is None else window.dtype)
+        self.offset, self.scale = quantisation(self.dtype)
+        if filename is not None and os.path.exists(filename):
+            window = np.memmap(filename, dtype=self.dtype, mode='r+')
+            window = window.reshape(backend.n_channels, -1)
+        if window is None:
+            self.length = length
+            self._n_samples = int(self.length*backend.samples_per_second)
+            shape = (self.backend.n_channels, self._n_samples)
+            if lazy:
+                pass
+            elif filename is not None:
+                self.window = np.memmap(filename, dtype=self.dtype, mode='w+', shape=shape)
+                self._fill_noise()
+            elif seed is not None:
+                self.window = self.generate()
+            else:
+                self.window = self._quantise(np.random.normal(0, 1, shape))
+            # Generated noise is standard normal, stored with offset and scale
+            self.noise_median = self.offset
+            self.noise_std = self.scale
+        else:
+            self.length = window.shape[1] / backend.samples_per_second
+            self._n_samples = window.shape[1]
+            self.window = window
+            # self.window += np.abs(np.min(self.window))
+            if noise is not None:
+                self.noise_median, self.noise_std = noise
+            else:
+                # Out-of-core windows are described by their first chunk
+                sample = self.window[:, :self.chunk_size] if self.out_of_core() else self.window
+                self.noise_median = np.median(sample).copy()
+                self.noise_std = np.std(sample).copy()
 
         # Time
         self.time_to_index = lambda t_i : np.ceil((t_i-self.t0)/self.backend.sampling_time).astype(int)
         self.index_to_time = lambda index : index * self.backend.sampling_time + self.t0
         self.next_time = lambda i : i * self.backend.sampling_time
 
-        self.times = np.array([self.next_time(i) for i in range(int(self.backend.samples_per_second *
-                                                                    self.length))])
-        self.time_indices = np.array([self.time_to_index(t) for t in self.times])
         # self.snr = lambda snr, area : (self.noise_median + snr * self.noise_std) / np.sqrt(area)
         self.snr = lambda snr, area : snr / np.sqrt(area)
 
     @property
     def window(self):
+        if self._window is None:
+            # A lazy observation is generated whole on first use of its window
+            self._window = self.generate()
+            self.signals = []
         return self._window
 
     @window.setter
     def window(self, window):
         self._window = window
 
+    @property
+    def lazy(self):
+        """Whether the window is still generated on demand."""
+        return self._window is None
+
+    @property
+    def n_samples(self):
+        """Number of time samples of the window."""
+        return self._n_samples if self.lazy else self.window.shape[1]
+
+    @property
+    def times(self):
+        """Time of each sample (in second, from the start of the observation)."""
+        return self.next_time(np.arange(self.n_samples))
+
+    @property
+    def time_indices(self):
+        """Index of each sample."""
+        return self.time_to_index(self.times)
+
+    def noise(self, start=0, stop=None, channels=slice(None)):
+        """Procedural noise of part of the observation.
+
+        Parameters
+        ----------
+        start : int
+            First time sample (default: 0)
+        stop : int
+            End time sample (default: n_samples)
+        channels : slice
+            Contiguous channels (default: all)
+
+        Returns
+        -------
+        noise : Numpy.array
+            Standard normal noise (n_selected_channels, stop - start), the same
+            whichever part of the observation it is generated with
+
+        """
+        if self.seed is None:
+            raise ValueError("Procedural noise needs a seed")
+        if stop is None:
+            stop = self.n_samples
+        first, last, _ = channels.indices(self.backend.n_channels)
+        tile_channels, tile_samples = self.tile_channels, self.tile_samples
+
+        noise = np.empty((max(0, last - first), max(0, stop - start)))
+        for i in range(first // tile_channels, -(-last // tile_channels)):
+            for j in range(start // tile_samples, -(-stop // tile_samples)):
+                tile = np.random.Generator(np.random.Philox(key=self.seed, counter=[0, 0, i, j]))
+                tile = tile.standard_normal((tile_channels, tile_samples))
+                rows = slice(max(first, i * tile_channels), min(last, (i + 1) * tile_channels))
+                columns = slice(max(start, j * tile_samples), min(stop, (j + 1) * tile_samples))
+                noise[rows.start - first:rows.stop - first, columns.start - start:columns.stop - start] = \
+                    tile[rows.start - i * tile_channels:rows.stop - i * tile_channels,
+                         columns.start - j * tile_samples:columns.stop - j * tile_samples]
+        return noise
+
+    def generate(self, start=0, stop=None, channels=slice(None)):
+        """Part of a lazy observation: its procedural noise and the signals injected into it.
+
+        Parameters
+        ----------
+        start : int
+            First time sample (default: 0)
+        stop : int
+            End time sample (default: n_samples)
+        channels : slice
+            Contiguous channels (default: all)
+
+        Returns
+        -------
+        data : Numpy.array
+            2D Array (n_selected_channels, stop - start)
+
+        """
+        if stop is None:
+            stop = self.n_samples
+        first, _, _ = channels.indices(self.backend.n_channels)
+        data = self._quantise(self.noise(start, stop, channels))
+        # Signals are added in the order they were injected, as to a window
+        for add, signal in self.signals:
+            add(data, *signal, first_channel=first, first_sample=start)
+        return data
+
+    def out_of_core(self, window=[]):
+        """Whether a window (default: self.window) is memory-mapped, and processed chunk by chunk."""
+        if len(window) == 0:
+            window = self.window
+        return isinstance(window, np.memmap)
+
+    def flush(self):
+        """Write changes of a memory-mapped window to its file."""
+        if self.out_of_core():
+            self.window.flush()
+
+    def _quantise(self, noise):
+        # Standard normal noise in the data type of the observation
+        if self.dtype.kind == 'f' and self.offset == 0 and self.scale == 1:
+            return noise.astype(self.dtype, copy=False)
+        return to_dtype(self.offset + self.scale * noise, self.dtype)
+
+    def _add(self, data, value):
+        # Add a signal (in units of the noise standard deviation) to data in place
+        if data.dtype.kind == 'f':
+            data += self.scale * value
+        else:
+            data[...] = to_dtype(data + self.scale * value, data.dtype)
+
+    def _add_boxcars(self, data, channels, starts, stops, values, first_channel=0, first_sample=0):
+        # Add boxcars (channel, [start, stop), value) to the part of the data starting
+        # at first_channel and first_sample in place, clipped to it, one block of time
+        # samples at a time. Sparse blocks scatter-add every sample of their boxcars;
+        # dense ones scatter +value at the start and -value at the stop of each boxcar
+        # into a difference array, whose cumulative sum along time adds them all.
+        n_rows, n_columns = data.shape
+        rows = np.asarray(channels) - first_channel
+        starts = np.clip(np.asarray(starts) - first_sample, 0, n_columns)
+        stops = np.clip(np.asarray(stops) - first_sample, 0, n_columns)
+        keep = (rows >= 0) & (rows < n_rows) & (starts < stops)
+        if not keep.any():
+            return
+        order = np.argsort(starts[keep], kind='stable')
+        rows, starts, stops = rows[keep][order], starts[keep][order], stops[keep][order]
+        values = np.broadcast_to(values, keep.shape)[keep][order]
+        max_length = int((stops - starts).max())
+
+        for block_start in range(int(starts[0]), int(stops.max()), self.tile_samples):
+            block_stop = min(block_start + self.tile_samples, n_columns)
+            # Boxcars overlapping the block start less than max_length before it
+            i, j = np.searchsorted(starts, [block_start - max_length + 1, block_stop])
+            block_starts = np.maximum(starts[i:j], block_start) - block_start
+            block_stops = np.minimum(stops[i:j], block_stop) - block_start
+            overlapping = block_starts < block_stops
+            if not overlapping.any():
+                continue
+            block_rows, block_values = rows[i:j][overlapping], values[i:j][overlapping]
+            block_starts, block_stops = block_starts[overlapping], block_stops[overlapping]
+            first_row, last_row = block_rows.min(), block_rows.max() + 1
+            block = data[first_row:last_row, block_start:block_stop]
+
+            lengths = block_stops - block_starts
+            if 4 * lengths.sum() < block.size:
+                # Flat index of every sample of every boxcar, summed per sample
+                offsets = np.repeat(block_starts - np.cumsum(lengths) + lengths, lengths)
+                indices = (np.repeat(block_rows - first_row, lengths) * block.shape[1] +
+                           offsets + np.arange(lengths.sum()))
+                indices, inverse = np.unique(indices, return_inverse=True)
+                increments = np.bincount(inverse, weights=np.repeat(block_values, lengths))
+                samples = np.unravel_index(indices, block.shape)
+                selected = block[samples]
+                self._add(selected, increments)
+                block[samples] = selected
+            else:
+                edges = np.zeros((last_row - first_row, block_stop - block_start + 1))
+                np.add.at(edges, (block_rows - first_row, block_starts), block_values)
+                np.add.at(edges, (block_rows - first_row, block_stops), -block_values)
+                self._add(block, np.cumsum(edges[:, :-1], axis=1))
+
+    def _add_profiles(self, data, channels, starts, profiles, first_channel=0, first_sample=0):
+        # Add profiles (n_channels, n_samples), starting at starts, to the part of the
+        # data starting at first_channel and first_sample in place, clipped to it
+        n_rows, n_columns = data.shape
+        rows = (np.asarray(channels) - first_channel)[:, None]
+        columns = np.asarray(starts)[:, None] - first_sample + np.arange(profiles.shape[1])
+        inside = (rows >= 0) & (rows < n_rows) & (columns >= 0) & (columns < n_columns)
+        samples = (np.broadcast_to(rows, inside.shape)[inside], columns[inside])
+        selected = data[samples]
+        self._add(selected, profiles[inside])
+        data[samples] = selected
+
+    def _fill_noise(self):
+        # Whole channels at a time (contiguous in the file), about one chunk in size
+        n_channels, n_samples = self.window.shape
+        n_rows = max(1, self.chunk_size * n_channels // max(n_samples, 1))
+        noise = lambda c: self._quantise(np.random.normal(0, 1, (min(n_rows, n_channels - c), n_samples))
+                                         if self.seed is None else self.noise(channels=slice(c, c + n_rows)))
+        _written_behind(self.window, ((slice(c, c + n_rows), noise(c)) for c in range(0, n_channels, n_rows)))
+
+    def _blocks(self, window, by_channel=False):
+        # Index tuples of the chunks of a window: whole channels, about one chunk in
+        # size, for per-channel algorithms, and chunk_size time samples otherwise
+        n_channels, n_samples = window.shape
+        if by_channel:
+            n_rows = max(1, self.chunk_size * n_channels // max(n_samples, 1))
+            return [(slice(c, c + n_rows), slice(None)) for c in range(0, n_channels, n_rows)]
+        return [(slice(None), slice(t, t + self.chunk_size)) for t in range(0, n_samples, self.chunk_size)]
+
+    def _clean_chunks(self, clean, window, by_channel=False, return_mask=False):
+        # Apply a cleaning function to the chunks of an out-of-core window
+        blocks = self._blocks(window, by_channel)
+        if return_mask:
+            mask = RFIMask(window.shape)
+            for (rows, columns), chunk in zip(blocks, _prefetched(window, blocks)):
+                mask.flag(clean(chunk, return_mask=True).to_bool(), channels=rows, start=columns.start or 0)
+            return mask.compress()
+        _map_blocks(clean, window, blocks)
+        return window
+
+
+    def delay_plan(self, dms, downsample=1):
+        """Get the (cached) delay plan of a DM grid for this observation's backend.
+
+        Parameters
+        ----------
+        dms : (float | list | Numpy.array)
+            Grid of dispersion measures
+        downsample : int
+            Downsampling factor of the data the shifts apply to (default: 1)
+
+        Returns
+        -------
+        plan : DelayPlan
+            Delays and integer sample shifts (n_dm, n_channels) of the grid
+
+        """
+        return delay_plan(self.backend, dms, sampling_time=downsample*self.backend.sampling_time)
+
+    def downsample(self, factor, window=[]):
+        """Average an observation window over blocks of time samples.
+
+        Parameters
+        ----------
+        factor : int
+            Number of time samples averaged together
+        window : (list | Numpy.array)
+            An observation window (to downsample a specific instance of window). If empty, uses self.window
 
-    def time_cleaning(self, window=[], n_iter=1, threshold=3.25, symetric=False, keep_state=False):
+        Returns
+        -------
+        window : Numpy.array
+            The downsampled window (n_channels, n_samples // factor).
+
+        """
+        if len(window) == 0:
+            window = self.window
+        if factor == 1:
+            return window
+
+        n_samples = window.shape[1] // factor * factor
+        return window[:, :n_samples].reshape(window.shape[0], -1, factor).mean(axis=2,
+                                                                               dtype=accumulation_dtype(window.dtype))
+
+    def time_cleaning(self, window=[], n_iter=1, threshold=3.25, symmetric=False, keep_state=False, return_mask=False,
+                      workers=1):
         """RFI mitigation (cleaning) in time domain.
 
         Parameters
@@ -63,8 +433,14 @@ class Observation():
             An observation window (to clean a specific instance of window). If empty, cleans self.window
         n_iter : int
             Number of cleaning iteration
+        symmetric : bool
+            Filter equally or not on both side of the distribution
         keep_state : bool
             Save result of cleaning to self.window
+        return_mask : bool
+            Leave the window untouched and return the RFIMask of the samples to replace (see apply_mask)
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
 
         Returns
         -------
@@ -75,15 +451,26 @@ class Observation():
         if len(window) == 0:
             window = self.window
 
+        if self.out_of_core(window):
+            # Channels are cleaned independently, so whole channels are read at a time
+            clean = lambda chunk, return_mask=False: RFIm().tdsc_amber(chunk, threshold=threshold, n_iter=n_iter,
+                                                                       symmetric=symmetric, return_mask=return_mask,
+                                                                       workers=workers)
+            return self._clean_chunks(clean, window, by_channel=True, return_mask=return_mask)
+
+        if return_mask:
+            return RFIm().tdsc_amber(window, threshold=threshold, n_iter=n_iter, symmetric=symmetric, return_mask=True, workers=workers)
+
         if keep_state:
-            window = RFIm().tdsc_amber(window, threshold=threshold, n_iter=n_iter, symetric=symetric)
+            window = RFIm().tdsc_amber(window, threshold=threshold, n_iter=n_iter, symmetric=symmetric, workers=workers)
         else:
-            return RFIm().tdsc_amber(window, threshold=threshold, n_iter=n_iter, symetric=symetric)
+            return RFIm().tdsc_amber(window, threshold=threshold, n_iter=n_iter, symmetric=symmetric, workers=workers)
 
         self.window = window
         return self.window
 
-    def frequency_cleaning(self, window=[], n_iter=1, bin_size=32, threshold=2.75, symetric=False, keep_state=False):
+    def frequency_cleaning(self, window=[], n_iter=1, bin_size=32, threshold=2.75, symmetric=False, keep_state=False,
+                           return_mask=False, workers=1):
         """RFI mitigation (cleaning) in frequency domain.
 
         Parameters
@@ -92,6 +479,111 @@ class Observation():
             An observation window (to clean a specific instance of window). If empty, cleans self.window
         n_iter : int
             Number of cleaning iteration
+        symmetric : bool
+            Filter equally or not on both side of the distribution
+        keep_state : bool
+            Save result of cleaning to self.window
+        return_mask : bool
+            Leave the window untouched and return the RFIMask of the samples to replace (see apply_mask)
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
+
+        Returns
+        -------
+        self.window : Numpy.array
+            The cleaned window.
+
+        """
+        if len(window) == 0:
+            window = self.window
+
+        if self.out_of_core(window):
+            # Spectra are cleaned independently, so chunks of time samples are read at a time
+            clean = lambda chunk, return_mask=False: RFIm().fdsc_amber(chunk, n_iter=n_iter, bin_size=bin_size,
+                                                                       threshold=threshold, symmetric=symmetric,
+                                                                       return_mask=return_mask, workers=workers)
+            return self._clean_chunks(clean, window, return_mask=return_mask)
+
+        if return_mask:
+            return RFIm().fdsc_amber(window, n_iter=n_iter, bin_size=bin_size, threshold=threshold,
+                                     symmetric=symmetric, return_mask=True, workers=workers)
+
+        if keep_state:
+            window = RFIm().fdsc_amber(window, n_iter=n_iter, bin_size=bin_size, threshold=threshold, symmetric=symmetric,
+                                       workers=workers)
+        else:
+            return RFIm().fdsc_amber(window, n_iter=n_iter, bin_size=bin_size, threshold=threshold, symmetric=symmetric,
+                                     workers=workers)
+
+        self.window = window
+        return self.window
+
+    def dm0_cleaning(self, window=[], threshold=3.25, keep_state=False, return_mask=False, workers=1):
+        if len(window) == 0:
+            window = self.window
+
+        if return_mask:
+            return RFIm().dm0clean(window, threshold=threshold, return_mask=True, workers=workers)
+
+        if keep_state:
+            window = RFIm().dm0clean(window, threshold=threshold, workers=workers)
+        else:
+            return RFIm().dm0clean(window, threshold=threshold, workers=workers)
+
+        self.window = window
+        return self.window
+
+    def kurtosis_cleaning(self, window=[], block_size=256, threshold=3., keep_state=False, return_mask=False,
+                          workers=1):
+        """RFI mitigation (cleaning) with spectral kurtosis (see RFIm.spectral_kurtosis).
+
+        Parameters
+        ----------
+        window : (list | Numpy.array)
+            An observation window (to clean a specific instance of window). If empty, cleans self.window
+        block_size : int
+            Number of samples per spectral kurtosis estimate
+        threshold : float
+            Threshold to use for sigma cut inequality on spectral kurtosis
+        keep_state : bool
+            Save result of cleaning to self.window
+        return_mask : bool
+            Leave the window untouched and return the RFIMask of the samples to replace (see apply_mask)
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
+
+        Returns
+        -------
+        self.window : Numpy.array
+            The cleaned window.
+
+        """
+        if len(window) == 0:
+            window = self.window
+
+        if return_mask:
+            return RFIm().spectral_kurtosis(window, block_size=block_size, threshold=threshold, return_mask=True,
+                                            workers=workers)
+
+        if keep_state:
+            window = RFIm().spectral_kurtosis(window, block_size=block_size, threshold=threshold, workers=workers)
+        else:
+            return RFIm().spectral_kurtosis(window, block_size=block_size, threshold=threshold, workers=workers)
+
+        self.window = window
+        return self.window
+
+    def fused_cleaning(self, steps=('dm0', 'time', 'frequency'), window=[], tile_size=128, keep_state=False):
+        """RFI mitigation (cleaning) with a chain of cuts applied tile by tile (see RFIm.fused_chain).
+
+        Parameters
+        ----------
+        steps : list
+            Steps in order, each 'dm0', 'time', 'frequency' or a (name, kwargs) pair
+        window : (list | Numpy.array)
+            An observation window (to clean a specific instance of window). If empty, cleans self.window
+        tile_size : int
+            Number of time samples per tile
         keep_state : bool
             Save result of cleaning to self.window
 
@@ -105,26 +597,95 @@ class Observation():
             window = self.window
 
         if keep_state:
-            window = RFIm().fdsc_amber(window, n_iter=n_iter, bin_size=bin_size, threshold=threshold, symetric=symetric)
+            window = RFIm().fused_chain(window, steps=steps, tile_size=tile_size)
         else:
-            return RFIm().fdsc_amber(window, n_iter=n_iter, bin_size=bin_size, threshold=threshold, symetric=symetric)
+            return RFIm().fused_chain(window, steps=steps, tile_size=tile_size)
 
         self.window = window
         return self.window
 
-    def dm0_cleaning(self, window=[], threshold=3.25, keep_state=False):
+    def clean_chunks(self, cleaners=None, chunk_size=None, window=[], keep_state=False):
+        """RFI mitigation chunk by chunk with streaming cleaners.
+
+        The cleaners keep running statistics across chunks, so the cleaned window
+        is the same for any chunk size.
+
+        Parameters
+        ----------
+        cleaners : list
+            Streaming cleaners (e.g. StreamingTimeCleaner, StreamingFrequencyCleaner),
+            applied in order to each chunk (default: a new StreamingTimeCleaner and
+            StreamingFrequencyCleaner)
+        chunk_size : int
+            Number of time samples per chunk (default: self.chunk_size)
+        window : (list | Numpy.array)
+            An observation window (to clean a specific instance of window). If empty, cleans self.window
+        keep_state : bool
+            Save result of cleaning to self.window
+
+        Returns
+        -------
+        self.window : Numpy.array
+            The cleaned window.
+
+        """
+        if len(window) == 0:
+            window = self.window
+        if cleaners is None:
+            cleaners = [StreamingTimeCleaner(self.backend.n_channels),
+                        StreamingFrequencyCleaner(self.backend.n_channels)]
+
+        def clean(chunk):
+            for cleaner in cleaners:
+                cleaner.clean(chunk)
+            return chunk
+
+        if self.out_of_core(window):
+            chunk_size = self.chunk_size if chunk_size is None else chunk_size
+            _map_blocks(clean, window, [(slice(None), slice(t, t + chunk_size))
+                                        for t in range(0, window.shape[1], chunk_size)])
+        else:
+            for chunk in self.iter_chunks(chunk_size, window=window):
+                clean(chunk)
+
+        if keep_state:
+            self.window = window
+        return window
+
+    def apply_mask(self, mask, window=[], replacement=None, keep_state=False):
+        """Replace the samples flagged by an RFIMask.
+
+        Parameters
+        ----------
+        mask : RFIMask
+            Flagged samples, e.g. from time_cleaning(return_mask=True), possibly
+            combined with others using |
+        window : (list | Numpy.array)
+            An observation window (to clean a specific instance of window). If empty, cleans self.window
+        replacement : (float | Numpy.array)
+            Value, or value per channel, replacing flagged samples (default: the
+            mean of the unflagged samples of each channel)
+        keep_state : bool
+            Save result of cleaning to self.window
+
+        Returns
+        -------
+        self.window : Numpy.array
+            The cleaned window.
+
+        """
         if len(window) == 0:
             window = self.window
 
         if keep_state:
-            window = RFIm().dm0clean(window, threshold=threshold)
+            window = RFIm().apply_mask(window, mask, replacement=replacement)
         else:
-            return RFIm().dm0clean(window, threshold=threshold)
+            return RFIm().apply_mask(window, mask, replacement=replacement)
 
         self.window = window
         return self.window
 
-    def dedisperse(self, dm, window=[]):
+    def dedisperse(self, dm, window=[], workers=1, out=None):
         """Dedisperse an observation window for a given dispersion measure (DM).
 
         Parameters
@@ -133,6 +694,12 @@ class Observation():
             Dispersion measure to use for dedispersion
         window : (list | Numpy.array)
             An observation window (to clean a specific instance of window). If empty, cleans self.window
+        workers : int
+            Number of threads, each shifting a block of channels (default: 1; None for the number of CPUs)
+        out : Numpy.array
+            Array receiving the dedispersed window (default: a new array, or for a memory-mapped
+            window a new .npy file next to its file, <name>_dm<dm>.npy, opened with
+            np.lib.format.open_memmap so that the dedispersed window is never held in memory)
 
         Returns
         -------
@@ -143,29 +710,497 @@ class Observation():
         if len(window) == 0:
             window = self.window
 
-        return np.array([
-            np.roll(window[i].copy(), -r) for i, r in zip(
-                range(window.shape[0]),
-                self.time_to_index(Pulse(self.backend).delays(dm))
-            )
-        ])
+        shifts = self.delay_plan(dm).shifts
+        if not self.out_of_core(window):
+            dedispersed = Dedispersion().brute_force(window, shifts, keep_windows=True, workers=workers)[1][0]
+            if out is None:
+                return dedispersed
+            out[:] = dedispersed
+            return out
+
+        # Each chunk is read with the max_shift samples following it (wrapping around
+        # the end, as numpy.roll would), which its dedispersed samples need
+        n_samples = window.shape[1]
+        shifts = shifts % n_samples
+        max_shift = int(shifts.max())
+        if out is None:
+            out = np.lib.format.open_memmap("%s_dm%g.npy" % (os.path.splitext(window.filename)[0], dm),
+                                            mode='w+', dtype=window.dtype, shape=window.shape)
+        starts = range(0, n_samples, self.chunk_size)
+        blocks = [(slice(None), np.arange(t, min(t + self.chunk_size, n_samples) + max_shift) % n_samples)
+                  for t in starts]
+        for t, chunk in zip(starts, _prefetched(window, blocks)):
+            dedispersed = Dedispersion().brute_force(chunk, shifts, keep_windows=True, workers=workers)[1][0]
+            out[:, t:t + self.chunk_size] = dedispersed[:, :chunk.shape[1] - max_shift]
+        return out
+
+    def dedisperse_many(self, dms, window=[], method='brute_force', keep_windows=False, block_size=None,
+                        subband_size=None, downsample=1, workers=1):
+        """Dedisperse an observation window for many dispersion measures at once.
+
+        Parameters
+        ----------
+        dms : (list | Numpy.array)
+            Dispersion measures to use for dedispersion
+        window : (list | Numpy.array)
+            An observation window (to dedisperse a specific instance of window). If empty, uses self.window
+        method : str
+            Dedispersion algorithm, 'brute_force', 'tree' or 'fdmt' (default: 'brute_force').
+        keep_windows : bool
+            Also return the dedispersed window for each DM (brute_force only)
+        block_size : int
+            Number of DMs dedispersed together (default: limited by Dedispersion's memory budget)
+        subband_size : int
+            Number of channels per subband of the tree method (default: 16), or merged by the
+            fdmt method before its subbands are combined (default: the full band)
+        downsample : int
+            Number of time samples averaged together before dedispersion (default: 1)
+        workers : int
+            Number of threads, each dedispersing a block of DMs (brute_force only, default: 1;
+            None for the number of CPUs). Out-of-core windows are dedispersed by brute_force
+            chunk by chunk in the calling thread instead.
+
+        Returns
+        -------
+        plane : Numpy.array
+            The DM-time plane (n_dm, n_samples // downsample).
+        windows : Numpy.array
+            The dedispersed windows (n_dm, n_channels, n_samples), only if keep_windows.
+
+        """
+        if len(window) == 0:
+            window = self.window
+        window = self.downsample(downsample, window=window)
+
+        shifts = self.delay_plan(dms, downsample=downsample).shifts
+        if method == 'brute_force' and self.out_of_core(window):
+            if keep_windows:
+                raise ValueError("Out-of-core windows are not dedispersed into windows, use dedisperse(out=...)")
+            return self._dedisperse_out_of_core(window, shifts)
+        elif method == 'brute_force':
+            return Dedispersion().brute_force(window, shifts, block_size=block_size, keep_windows=keep_windows,
+                                              workers=workers)
+        elif keep_windows:
+            raise ValueError("Only brute_force dedispersion produces dedispersed windows")
+        elif method == 'tree':
+            return Dedispersion().tree(window, shifts, subband_size=16 if subband_size is None else subband_size)
+        elif method == 'fdmt':
+            _, plane = Dedispersion().fdmt(window, self.backend.frequencies, self.backend.fmax,
+                                           downsample*self.backend.sampling_time, np.max(dms),
+                                           subband_size=subband_size, dms=dms)
+            return plane
+        else:
+            raise ValueError("Unknown dedispersion method '%s'" % method)
+
+    def _dedisperse_out_of_core(self, window, shifts):
+        # Overlap-save dedispersion of the chunks of a memory-mapped window, followed by
+        # its first max_shift samples again so that delayed samples wrap around as with
+        # numpy.roll: the plane is the same as brute_force's
+        n_samples = window.shape[1]
+        shifts = np.atleast_2d(shifts) % n_samples
+        max_shift = int(shifts.max())
+        dedisperser = ChunkedDedispersion(shifts, self.chunk_size, dtype=window.dtype)
+        blocks = self._blocks(window) + [(slice(None), slice(t, min(t + self.chunk_size, max_shift)))
+                                         for t in range(0, max_shift, self.chunk_size)]
+
+        plane = np.empty((shifts.shape[0], n_samples), dtype=accumulation_dtype(window.dtype))
+        for chunk in _prefetched(window, blocks):
+            start = dedisperser.n_emitted
+            output = dedisperser.process(chunk)
+            plane[:, start:start + output.shape[1]] = output
+        return plane
+
+    def dedisperse_ddplan(self, ddplan, window=[], method='brute_force', **kwargs):
+        """Dedisperse an observation window following a DDPlan.
+
+        Parameters
+        ----------
+        ddplan : DDPlan
+            Plan of DM trials and downsampling factors
+        window : (list | Numpy.array)
+            An observation window (to dedisperse a specific instance of window). If empty, uses self.window
+        method : str
+            Dedispersion algorithm, 'brute_force', 'tree' or 'fdmt' (default: 'brute_force')
+        **kwargs
+            Extra arguments for dedisperse_many
+
+        Returns
+        -------
+        planes : list
+            One (dms, downsample, plane) tuple per range of the plan, plane being the
+            DM-time plane (n_dm, n_samples // downsample) of the range.
+
+        """
+        if len(window) == 0:
+            window = self.window
+
+        planes = []
+        for i, (_, _, _, downsample) in enumerate(ddplan.ranges):
+            dms = ddplan.dms[ddplan.range_index == i]
+            if len(dms):
+                planes.append((dms, downsample,
+                               self.dedisperse_many(dms, window=window, method=method, downsample=downsample,
+                                                    **kwargs)))
+        return planes
+
+    def search(self, dms, widths=(1, 2, 4, 8, 16, 32, 64, 128), threshold=8., window=[],
+               method='brute_force', downsample=1, time_radius=None, dm_radius=None, **kwargs):
+        """Search an observation window for single pulses.
+
+        The window is dedispersed, boxcar filtered over several widths, thresholded,
+        and the candidates of each event are clustered into one.
+
+        Parameters
+        ----------
+        dms : (list | Numpy.array)
+            Dispersion measures to search
+        widths : list of int
+            Boxcar widths (in samples, after downsampling)
+        threshold : float
+            Detection threshold on S/N (default: 8)
+        window : (list | Numpy.array)
+            An observation window (to search a specific instance of window). If empty, uses self.window
+        method : str
+            Dedispersion algorithm, see dedisperse_many (default: 'brute_force')
+        downsample : int
+            Number of time samples averaged together before dedispersion (default: 1)
+        time_radius : float
+            Clustering linking length in time (in second) (default: the largest boxcar)
+        dm_radius : float
+            Clustering linking length in DM (default: twice the largest DM step)
+        **kwargs
+            Extra arguments for dedisperse_many (workers also sets the threads of the boxcar filters)
+
+        Returns
+        -------
+        candidates : Candidates
+            One candidate per detected event.
+
+        """
+        dms = np.atleast_1d(dms)
+        sampling_time = downsample * self.backend.sampling_time
+        plane = self.dedisperse_many(dms, window=window, method=method, downsample=downsample, **kwargs)
+        snr, width_index = SNR().boxcar_peak(plane, widths=widths, workers=kwargs.get('workers', 1))
+        candidates = Candidates.from_snr(snr, dms, widths, threshold, width_index=width_index,
+                                         sampling_time=sampling_time, t0=self.t0)
+
+        if time_radius is None:
+            time_radius = max(widths) * sampling_time
+        if dm_radius is None:
+            dm_radius = 2 * np.max(np.diff(dms)) if len(dms) > 1 else 1.
+        return candidates.cluster(time_radius, dm_radius)
+
+    def iter_chunks(self, chunk_size=None, window=[], prefetch=False):
+        """Iterate over an observation window in contiguous chunks of time samples.
+
+        Parameters
+        ----------
+        chunk_size : int
+            Number of time samples per chunk (default: self.chunk_size)
+        window : (list | Numpy.array)
+            An observation window (to iterate over a specific instance of window). If empty, uses self.window
+        prefetch : bool
+            Yield in-memory copies of the chunks, each read by a thread while the
+            previous one is processed, e.g. from a memory-mapped window (default: False)
+
+        Yields
+        ------
+        chunk : Numpy.array
+            A view (or copy, if prefetch) of the window (n_channels, n_samples). The last chunk may be shorter.
+            Chunks of a lazy observation are generated one at a time (by a thread, if prefetch).
+
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if len(window) == 0 and self.lazy:
+            starts = range(0, self.n_samples, chunk_size)
+            generate = lambda start: self.generate(start, min(start + chunk_size, self.n_samples))
+            if prefetch:
+                yield from _prefetched(None, list(starts), read=generate)
+            else:
+                for start in starts:
+                    yield generate(start)
+            return
+        if len(window) == 0:
+            window = self.window
+
+        blocks = [(slice(None), slice(t, t + chunk_size)) for t in range(0, window.shape[1], chunk_size)]
+        if prefetch:
+            yield from _prefetched(window, blocks)
+        else:
+            for block in blocks:
+                yield window[block]
+
+    def dedisperse_chunks(self, dms, chunk_size=None, window=[]):
+        """Dedisperse an observation window chunk by chunk, without wrapping delayed samples.
+
+        Parameters
+        ----------
+        dms : (list | Numpy.array)
+            Dispersion measures to use for dedispersion
+        chunk_size : int
+            Number of time samples per chunk (default: self.chunk_size)
+        window : (list | Numpy.array)
+            An observation window (to dedisperse a specific instance of window). If empty, uses self.window
+
+        Yields
+        ------
+        start : int
+            Index of the first output sample of the chunk
+        plane : Numpy.array
+            The DM-time plane of the chunk's valid output samples (n_dm, n_valid).
+            Samples whose sweep runs past the end of the window are never emitted.
+
+        """
+        if len(window) == 0 and not self.lazy:
+            window = self.window
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        dtype = window.dtype if len(window) else self.dtype
+        dedisperser = ChunkedDedispersion(self.delay_plan(dms).shifts, chunk_size, dtype=dtype)
+        for chunk in self.iter_chunks(chunk_size, window=window):
+            start = dedisperser.n_emitted
+            plane = dedisperser.process(chunk)
+            if plane.shape[1]:
+                yield start, plane
+
+    def dedisperse_subband(self, dms, n_subbands=32, nominal_dms=None, window=[]):
+        """Dedisperse an observation window for many dispersion measures with subband dedispersion.
+
+        Parameters
+        ----------
+        dms : (list | Numpy.array)
+            Dispersion measures to use for dedispersion
+        n_subbands : int
+            Number of subbands (default: 32)
+        nominal_dms : (list | Numpy.array)
+            Coarse DMs at which subbands are formed. If None, they are spaced so that
+            the delay error across the widest subband stays within one sample.
+        window : (list | Numpy.array)
+            An observation window (to dedisperse a specific instance of window). If empty, uses self.window
+
+        Returns
+        -------
+        plane : Numpy.array
+            The DM-time plane (n_dm, n_samples).
+        cubes : Numpy.array
+            The subband-time cube of each nominal DM (n_nominal, n_subbands, n_samples).
+        nominal_dms : Numpy.array
+            The nominal DMs used, each one the nearest to some of the dms.
+
+        """
+        if len(window) == 0:
+            window = self.window
+
+        dms = np.atleast_1d(dms)
+        frequencies = self.backend.frequencies
+        starts = np.linspace(0, self.backend.n_channels, n_subbands + 1).astype(int)[:-1]
+        stops = np.append(starts[1:], self.backend.n_channels) - 1
+
+        if nominal_dms is None:
+            sweep = DM_CONSTANT * np.max(frequencies[starts]**-2 - frequencies[stops]**-2)
+            step = 2 * self.backend.sampling_time / sweep
+            nominal_dms = np.arange(dms.min(), dms.max() + step, step)
+        nominal_dms = np.atleast_1d(nominal_dms)
+        nearest = np.abs(dms[:, None] - nominal_dms[None, :]).argmin(axis=1)
+        used, nominal_index = np.unique(nearest, return_inverse=True)
+        nominal_dms = nominal_dms[used]
+
+        plane, cubes = Dedispersion().subband(window,
+                                              self.delay_plan(dms).shifts,
+                                              self.delay_plan(nominal_dms).shifts,
+                                              nominal_index,
+                                              starts)
+        return plane, cubes, nominal_dms
+
+    def fdmt(self, max_dm, window=[], subband_size=None):
+        """Compute the complete DM-time plane of a window with the Fast Dispersion Measure Transform.
+
+        Parameters
+        ----------
+        max_dm : float
+            Largest dispersion measure of the plane
+        window : (list | Numpy.array)
+            An observation window (to dedisperse a specific instance of window). If empty, uses self.window
+        subband_size : int
+            Number of channels merged by the transform before its subbands are combined as by
+            brute force, trading speed for accuracy (default: None, the full band, see
+            Dedispersion.fdmt)
+
+        Returns
+        -------
+        dms : Numpy.array
+            Dispersion measure of each row, one sample of delay apart across the band
+        plane : Numpy.array
+            The DM-time plane (n_dm, n_samples).
+
+        """
+        if len(window) == 0:
+            window = self.window
+
+        return Dedispersion().fdmt(window, self.backend.frequencies, self.backend.fmax,
+                                   self.backend.sampling_time, max_dm, subband_size=subband_size)
+
+    def dedispersion_accuracy(self, dms, method='tree', width=0.001, **kwargs):
+        """Report the S/N loss of a dedispersion method with respect to brute force.
+
+        Parameters
+        ----------
+        dms : (list | Numpy.array)
+            Dispersion measures to assess
+        method : str
+            Dedispersion algorithm to assess (default: 'tree')
+        width : float
+            Width of the test pulse (in second)
+        **kwargs
+            Extra arguments for the dedispersion method (e.g. subband_size)
+
+        Returns
+        -------
+        loss : Numpy.array
+            Fractional S/N loss per DM (0 means as good as brute force)
+
+        """
+        dms = np.atleast_1d(dms)
+        shifts = self.delay_plan(dms).shifts
+        width = max(1, int(self.time_to_index(self.t0 + width)))
+        dedisperse = lambda window, i : self.dedisperse_many(dms[i:i+1], window=window, method=method, **kwargs)
+        return Dedispersion().snr_loss(shifts, self.window.shape[1], dedisperse, width=width)
 
     def add_signal(self, signal_value, x_t0, x_t1, y_t0, y_t1):
-        self.window[x_t0:x_t1, y_t0:y_t1] += signal_value
+        if self.lazy:
+            # Kept as boxcars (with bounds clipped as slicing would) until the data are generated
+            x_t0, x_t1, _ = slice(x_t0, x_t1).indices(self.backend.n_channels)
+            y_t0, y_t1, _ = slice(y_t0, y_t1).indices(self.n_samples)
+            channels = np.arange(x_t0, x_t1)
+            self.signals.append((self._add_boxcars, (channels, np.full(channels.shape, y_t0),
+                                                     np.full(channels.shape, y_t1), signal_value)))
+            return
+        self._add(self.window[x_t0:x_t1, y_t0:y_t1], signal_value)
 
     def add_dispersed_pulse(self, dm, width, pulse_t0, snr=100, verbose=False):
-        pulse = Pulse(self.backend, width=width)
-        pulse_t_start = self.index_to_time(index=self.time_to_index(pulse_t0).astype(int))
-        t_idx = self.time_to_index(t_i=pulse_t_start+pulse.delays(dm=dm))
-        area = np.sqrt(self.backend.n_channels*pulse.width/self.backend.sampling_time)
-        value = self.snr(snr, area)
-
-        for i in range(t_idx.shape[0]):
-            self.add_signal(value, i, i+1, t_idx[i], t_idx[i]+self.time_to_index(pulse.width))
+        value = self.add_dispersed_pulses(dm, width, pulse_t0, snr)[0]
 
         if verbose:
+            area = np.sqrt(self.backend.n_channels*width/self.backend.sampling_time)
             print ("snr:", snr, "value: ", value, "area: ", area)
 
+    def add_dispersed_pulses(self, dms, widths, t0s, snrs=100, spectral_indices=0., matched=False):
+        """Inject many dispersed boxcar pulses at once.
+
+        Every pulse is a boxcar of its width (at least one sample) in each channel,
+        starting at its dispersion delay after its arrival time. All pulses are added in one
+        scatter-add of their start and end edges followed by a cumulative sum along
+        time, rather than a slice per channel and pulse. Parts of pulses outside
+        the window (before its start or past its end) are dropped.
+
+        A pulse of spectral index alpha has a value proportional to frequency**alpha
+        across the band, normalised to the same mean value (hence S/N) as a flat one.
+
+        Parameters
+        ----------
+        dms : (float | list | Numpy.array)
+            Dispersion measure of each pulse
+        widths : (float | list | Numpy.array)
+            Width of each pulse (in second)
+        t0s : (float | list | Numpy.array)
+            Arrival time of each pulse at the top of the band (in second)
+        snrs : (float | list | Numpy.array)
+            Signal-to-noise ratio of each pulse
+        spectral_indices : (float | list | Numpy.array)
+            Spectral index of each pulse (default: 0, i.e. flat)
+        matched : bool
+            The snrs are the S/N of the pulses through their matched boxcar, i.e. of the
+            sum of their samples over all channels, rather than values set by snr()
+            (default: False)
+
+        Returns
+        -------
+        values : Numpy.array
+            Mean value of each pulse per channel and sample (in units of the noise standard deviation)
+
+        """
+        dms, widths, t0s, snrs, spectral_indices = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (dms, widths, t0s, snrs, spectral_indices)))
+        n_pulses, n_channels = dms.shape[0], self.backend.n_channels
+
+        n_samples = np.maximum(1, self.time_to_index(self.t0 + widths))
+        starts = self.time_to_index(t0s)[:, None] + self.delay_plan(dms).shifts
+        stops = starts + n_samples[:, None]
+        if matched:
+            values = snrs / np.sqrt(n_channels * n_samples)
+        else:
+            area = np.sqrt(n_channels*widths/self.backend.sampling_time)
+            values = self.snr(snrs, area)
+        if np.any(spectral_indices):
+            channel_values = values[:, None] * Pulse(self.backend).spectrum(spectral_indices)
+        else:
+            channel_values = np.repeat(values, n_channels)
+
+        boxcars = (np.tile(np.arange(n_channels), n_pulses), starts.ravel(), stops.ravel(),
+                   channel_values.ravel())
+        if self.lazy:
+            self.signals.append((self._add_boxcars, boxcars))
+        else:
+            self._add_boxcars(self.window, *boxcars)
+        return values
+
+    def add_pulse(self, pulse, dms, t0s, snrs=100, memory_budget=2**28):
+        """Inject dispersed pulses of the morphology of a Pulse.
+
+        Profiles are scattered, smeared and scaled by the spectrum of the pulse (see
+        Pulse.profiles), with the same fluence per channel as the boxcar of its
+        width that add_dispersed_pulses would inject for the same S/N. Parts of
+        pulses outside the window are dropped. Profiles are built and added for
+        blocks of pulses whose transforms fit in the memory budget.
+
+        Parameters
+        ----------
+        pulse : Pulse
+            Pulse of the backend of the observation
+        dms : (float | list | Numpy.array)
+            Dispersion measure of each pulse
+        t0s : (float | list | Numpy.array)
+            Arrival time of each pulse at the top of the band (in second)
+        snrs : (float | list | Numpy.array)
+            Signal-to-noise ratio of each pulse
+        memory_budget : int
+            Largest number of bytes of the profiles built at once (default: 256 MB)
+
+        Returns
+        -------
+        values : Numpy.array
+            Value of the equivalent boxcar of each pulse (in units of the noise standard deviation)
+
+        """
+        if pulse.backend.n_channels != self.backend.n_channels:
+            raise ValueError("The pulse has %d channels, the observation %d" %
+                             (pulse.backend.n_channels, self.backend.n_channels))
+        dms, t0s, snrs = np.broadcast_arrays(*(np.atleast_1d(np.asarray(x, dtype=float)) for x in (dms, t0s, snrs)))
+        n_channels = self.backend.n_channels
+
+        area = np.sqrt(n_channels*pulse.width/self.backend.sampling_time)
+        values = self.snr(snrs, area)
+        shifts = self.delay_plan(dms).shifts
+        spectrum = pulse.spectrum()[:, None]
+
+        # A block of pulses holds about five arrays of the transform length per channel
+        n_fft = 1 << (pulse.n_samples(dms.max(), self.backend.sampling_time) - 1).bit_length()
+        block_size = Dedispersion(memory_budget=memory_budget).block_size(n_channels, n_fft, itemsize=40)
+        channels = np.arange(n_channels)
+        for start in range(0, len(dms), block_size):
+            block = slice(start, start + block_size)
+            profiles, lead = pulse.profiles(dms[block], self.backend.sampling_time)
+            profiles *= (values[block] * self.time_to_index(self.t0 + pulse.width))[:, None, None] * spectrum
+            starts = self.time_to_index(t0s[block])[:, None] + shifts[block] - lead
+            for i in range(len(profiles)):
+                if self.lazy:
+                    self.signals.append((self._add_profiles, (channels, starts[i], profiles[i])))
+                else:
+                    self._add_profiles(self.window, channels, starts[i], profiles[i])
+        return values
+
     def add_rfi(self,
                 t_start=0., t_stop=0.5, t_step=0.03, t_width=0.003,
                 f_start=200, f_stop=250,
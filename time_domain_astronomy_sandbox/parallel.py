@@ -0,0 +1,41 @@
+"""Thread pool helpers."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def n_workers(workers):
+    """Number of threads for a workers argument (None for the number of CPUs)."""
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def run_blocks(function, blocks, workers=1):
+    """Call a function on every block, on a pool of threads.
+
+    Numpy releases the GIL in its heavy kernels (reductions, comparisons, copies),
+    so blocks of an array processed by threads run on as many cores. The function
+    should write its result into its own part of a shared output array, so that
+    blocks need no gathering.
+
+    Parameters
+    ----------
+    function : callable
+        Function of one block (e.g. a slice or first index)
+    blocks : iterable
+        Blocks to process
+    workers : int
+        Number of threads (default: 1, i.e. in the calling thread; None for the number of CPUs)
+
+    Returns
+    -------
+    results : list
+        Return values of the function, in the order of the blocks
+
+    """
+    workers = n_workers(workers)
+    blocks = list(blocks)
+    if workers == 1 or len(blocks) < 2:
+        return [function(block) for block in blocks]
+    with ThreadPoolExecutor(max_workers=min(workers, len(blocks))) as pool:
+        return list(pool.map(function, blocks))
@@ -0,0 +1,307 @@
+"""RingBuffer and StreamingPipeline classes."""
+import time
+import numpy as np
+from .backend import Backend
+from .rfim import RFIm
+from .streaming_rfim import StreamingTimeCleaner, StreamingFrequencyCleaner
+from .delays import delay_plan
+from .dedispersion import ChunkedDedispersion
+from .dtypes import accumulation_dtype
+from .snr import SNR
+from .candidates import Candidates
+
+
+class RingBuffer():
+    """RingBuffer class. A preallocated circular buffer of 2D (rows, time) data.
+
+    Every sample is written twice, capacity samples apart, so that the latest
+    samples can always be read as one contiguous view.
+    """
+
+    def __init__(self, n_rows, capacity, dtype=np.float64):
+        """Initialise RingBuffer class.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of rows (e.g. channels or DM trials)
+        capacity : int
+            Number of time samples kept
+        dtype : Numpy.dtype
+            Data type of the buffer
+
+        """
+        self.capacity = capacity
+        self.data = np.zeros((n_rows, 2 * capacity), dtype=dtype)
+        self.head = 0
+        self.size = 0
+
+    def write(self, block):
+        """Append samples, overwriting the oldest ones.
+
+        Parameters
+        ----------
+        block : Numpy.Array
+            2D Array (n_rows, n_samples)
+
+        """
+        block = block[:, -self.capacity:]
+        n_samples = block.shape[1]
+        first = min(n_samples, self.capacity - self.head)
+        for offset in (0, self.capacity):
+            self.data[:, offset + self.head:offset + self.head + first] = block[:, :first]
+            self.data[:, offset:offset + n_samples - first] = block[:, first:]
+        self.head = (self.head + n_samples) % self.capacity
+        self.size = min(self.size + n_samples, self.capacity)
+
+    def latest(self, n_samples=None):
+        """Read the latest samples.
+
+        Parameters
+        ----------
+        n_samples : int
+            Number of samples to read (default: all buffered samples)
+
+        Returns
+        -------
+        data : Numpy.Array
+            Contiguous view (n_rows, n_samples), oldest sample first
+
+        """
+        if n_samples is None:
+            n_samples = self.size
+        if n_samples > self.size:
+            raise ValueError("Only %d samples are buffered, %d requested" % (self.size, n_samples))
+        end = self.head + self.capacity
+        return self.data[:, end - n_samples:end]
+
+
+class StreamingPipeline():
+    """StreamingPipeline class. Chunk by chunk real-time single-pulse search."""
+
+    def __init__(self,
+                 backend:Backend,
+                 dms,
+                 chunk_size:int = None,
+                 cleaning=('time', 'frequency'),
+                 widths=(1, 2, 4, 8, 16, 32, 64),
+                 threshold:float = 8.,
+                 time_radius:float = None,
+                 dm_radius:float = None,
+                 max_hold:float = None,
+                 dtype=np.float64
+                ):
+        """Initialise StreamingPipeline class.
+
+        Each chunk of spectra is cleaned, dedispersed without wrapping (overlap-save),
+        boxcar filtered and thresholded, and its candidates are clustered. All state
+        between chunks is held in buffers allocated here, so memory does not grow
+        with the length of the observation.
+
+        Parameters
+        ----------
+        backend : Backend
+            An instance of Backend class
+        dms : (list | Numpy.array)
+            Dispersion measures to search
+        chunk_size : int
+            Largest number of time samples per chunk (default: samples_per_second)
+        cleaning : list
+            RFI mitigation steps applied to each chunk, in order: 'dm0', 'time',
+            'frequency' and 'kurtosis' (statistics of each chunk), 'running_time' and
+            'running_frequency' (statistics running across chunks, see StreamingTimeCleaner),
+            or callables taking and returning a chunk (default: ('time', 'frequency'))
+        widths : list of int
+            Boxcar widths (in samples)
+        threshold : float
+            Detection threshold on S/N (default: 8)
+        time_radius : float
+            Clustering linking length in time (in second) (default: the largest boxcar)
+        dm_radius : float
+            Clustering linking length in DM (default: twice the largest DM step)
+        max_hold : float
+            Longest time (in second) a cluster open at the end of a chunk is held back for the
+            next one: clusters whose first member is older are released even if still open,
+            e.g. under persistent RFI (default: 16 time_radius)
+        dtype : Numpy.dtype
+            Data type of the chunks (the DM-time plane is in its accumulation_dtype)
+
+        """
+        self.backend = backend
+        self.dms = np.atleast_1d(dms)
+        self.chunk_size = backend.samples_per_second if chunk_size is None else chunk_size
+        self.widths = widths
+        self.threshold = threshold
+        self.time_radius = max(widths) * backend.sampling_time if time_radius is None else time_radius
+        if dm_radius is None:
+            dm_radius = 2 * np.max(np.diff(self.dms)) if len(self.dms) > 1 else 1.
+        self.dm_radius = dm_radius
+        self.max_hold = 16 * self.time_radius if max_hold is None else max_hold
+
+        rfim = RFIm()
+        steps = {'dm0': rfim.dm0clean, 'time': rfim.tdsc_amber, 'frequency': rfim.fdsc_amber,
+                 'kurtosis': rfim.spectral_kurtosis,
+                 # Streaming cleaners keep their statistics across chunks
+                 'running_time': StreamingTimeCleaner(backend.n_channels),
+                 'running_frequency': StreamingFrequencyCleaner(backend.n_channels)}
+        self.cleaning = [steps[step] if isinstance(step, str) else step for step in cleaning]
+
+        self.chunk = np.zeros((backend.n_channels, self.chunk_size), dtype=dtype)
+        self.dedispersion = ChunkedDedispersion(delay_plan(backend, self.dms).shifts, self.chunk_size, dtype=dtype)
+        # The plane keeps the samples needed by boxcars starting in the next chunk
+        self.plane = RingBuffer(len(self.dms), self.chunk_size + max(widths) - 1, dtype=accumulation_dtype(dtype))
+
+        self.n_received = 0
+        self.n_dedispersed = 0
+        self.n_searched = 0
+        self.processing_time = 0.
+        # Unclustered candidates of events that may continue in the next chunk
+        self.pending = Candidates()
+
+    def clean(self, chunk, out=None):
+        """RFI mitigation of a chunk.
+
+        Parameters
+        ----------
+        chunk : Numpy.Array
+            2D Array (n_channels, n_samples), n_samples at most chunk_size. It is not modified.
+        out : Numpy.Array
+            Buffer (n_channels, chunk_size) the chunk is cleaned into (default: the pipeline's chunk buffer)
+
+        Returns
+        -------
+        chunk : Numpy.Array
+            The cleaned chunk, a view of out
+
+        """
+        work = (self.chunk if out is None else out)[:, :chunk.shape[1]]
+        np.copyto(work, chunk)
+        for clean in self.cleaning:
+            work = clean(work)
+        return work
+
+    def dedisperse(self, chunk):
+        """Dedisperse the next (cleaned) chunk.
+
+        Parameters
+        ----------
+        chunk : Numpy.Array
+            2D Array (n_channels, n_samples), following the previous chunk in time
+
+        Returns
+        -------
+        plane : Numpy.Array
+            DM-time plane of the newly valid output samples (n_dm, n_valid)
+
+        """
+        plane = self.dedispersion.process(chunk)
+        self.n_received += chunk.shape[1]
+        return plane
+
+    def search(self, plane):
+        """Matched filter and threshold the next samples of the DM-time plane.
+
+        Parameters
+        ----------
+        plane : Numpy.Array
+            DM-time plane (n_dm, n_samples), following the previous one in time
+
+        Clusters that may still link to candidates of the next samples (those with
+        a member within two clustering cells of the end of the searched samples)
+        are held back and clustered again with them, so that an event crossing a
+        chunk boundary comes out as one candidate. Clusters whose first member is
+        more than max_hold before that are released anyway, so that the candidates
+        held back stay bounded. flush() releases them at the end of the stream.
+
+        Returns
+        -------
+        candidates : Candidates
+            Clustered candidates of the events completed by these samples
+
+        """
+        self.plane.write(plane)
+        self.n_dedispersed += plane.shape[1]
+
+        # Boxcars of every width must fit within the dedispersed samples
+        n_ready = self.n_dedispersed - (max(self.widths) - 1) - self.n_searched
+        if n_ready <= 0:
+            return Candidates()
+
+        plane = self.plane.latest(n_ready + max(self.widths) - 1)
+        snr, width_index = SNR().boxcar_peak(plane, widths=self.widths)
+        candidates = Candidates.from_snr(snr[:, :n_ready], self.dms, self.widths, self.threshold,
+                                         width_index=width_index[:, :n_ready],
+                                         sampling_time=self.backend.sampling_time,
+                                         t0=self.n_searched * self.backend.sampling_time)
+        candidates.table['sample'] += self.n_searched
+        self.n_searched += n_ready
+
+        candidates = Candidates.concatenate([self.pending, candidates])
+        n_clusters, labels = candidates.cluster_labels(self.time_radius, self.dm_radius)
+        # Clustering cells link to their neighbours: a candidate from the cell of
+        # the end of the searched samples on links clusters down to the cell before
+        latest = np.full(n_clusters, -np.inf)
+        np.maximum.at(latest, labels, candidates['time'])
+        earliest = np.full(n_clusters, np.inf)
+        np.minimum.at(earliest, labels, candidates['time'])
+        boundary = (np.floor(self.n_searched * self.backend.sampling_time / self.time_radius) - 1) * self.time_radius
+        open_clusters = (latest[labels] >= boundary) & (earliest[labels] >= boundary - self.max_hold)
+        self.pending = candidates[open_clusters]
+        return candidates[~open_clusters].cluster(self.time_radius, self.dm_radius)
+
+    def flush(self):
+        """Release the candidates held back at the end of the searched samples.
+
+        Returns
+        -------
+        candidates : Candidates
+            Clustered candidates of the events still open at the end of the stream
+
+        """
+        candidates, self.pending = self.pending, Candidates()
+        return candidates.cluster(self.time_radius, self.dm_radius)
+
+    def process(self, chunk):
+        """Process the next chunk of spectra.
+
+        Parameters
+        ----------
+        chunk : Numpy.Array
+            2D Array (n_channels, n_samples), n_samples at most chunk_size, following
+            the previous chunk in time. It is not modified.
+
+        Returns
+        -------
+        candidates : Candidates
+            Candidates of the output samples completed by this chunk
+
+        """
+        start_time = time.perf_counter()
+        candidates = self.search(self.dedisperse(self.clean(chunk)))
+        self.processing_time += time.perf_counter() - start_time
+        return candidates
+
+    def run(self, chunks):
+        """Process a stream of chunks.
+
+        Parameters
+        ----------
+        chunks : iterable
+            Chunks of spectra (n_channels, n_samples), e.g. Observation.iter_chunks()
+
+        Yields
+        ------
+        candidates : Candidates
+            Candidates completed by each chunk, then those still open at the end (see flush)
+
+        """
+        for chunk in chunks:
+            yield self.process(chunk)
+        yield self.flush()
+
+    @property
+    def real_time_factor(self):
+        """Duration of the data processed over the time spent processing it (above 1 is faster than real time)."""
+        if self.processing_time == 0:
+            return np.inf
+        return self.n_received * self.backend.sampling_time / self.processing_time
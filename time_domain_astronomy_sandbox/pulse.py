@@ -1,5 +1,6 @@
 """Pulse class."""
 import numpy as np
+from scipy.special import erf
 from .backend import Backend
 from ipywidgets import interact
 import ipywidgets as widgets
@@ -10,42 +11,204 @@ rc('font', size=16)
 rc('axes', titlesize=18)
 rc('axes', labelsize=18)
 
+# Dispersion constant (in s MHz^2 pc^-1 cm^3)
+DM_CONSTANT = 4.148808 * 1000
+
 class Pulse():
     def __init__(self,
                  backend : Backend = Backend(),
                  width : int = 10,
+                 profile : str = 'boxcar',
+                 scattering_time : float = 0.,
+                 spectral_index : float = 0.,
+                 reference_frequency : float = None
                 ):
         """Initialise Pulse class.
 
+        The intrinsic profile of the pulse is a boxcar of its width or a Gaussian
+        of that full width at half maximum. In each channel, it is smeared by the
+        dispersion delay across the channel and scattered by an exponential tail of
+        timescale proportional to frequency**-4, and its amplitude is proportional
+        to frequency**spectral_index (see profiles and spectrum).
+
         Parameters
         ----------
         backend : Backend
             Backend class
         width : int
             Pulse width in second (default: 10)
+        profile : str
+            Intrinsic profile, 'boxcar' or 'gaussian' (default: 'boxcar')
+        scattering_time : float
+            Scattering timescale at the reference frequency (in second) (default: 0, i.e. no scattering)
+        spectral_index : float
+            Spectral index (default: 0, i.e. flat spectrum)
+        reference_frequency : float
+            Frequency of the scattering timescale (in MHz) (default: centre of the band)
 
         """
+        if profile not in ('boxcar', 'gaussian'):
+            raise ValueError("Unknown profile %s, expected 'boxcar' or 'gaussian'" % profile)
         self.backend = backend
         self.width = width
+        self.profile = profile
+        self.scattering_time = scattering_time
+        self.spectral_index = spectral_index
+        self.reference_frequency = ((backend.fmin + backend.fmax) / 2 if reference_frequency is None
+                                    else reference_frequency)
 
         # Frequency delay
-        self.dt = lambda dm, f_i: (4.148808 * 1000 * (f_i**-2 - self.backend.fmax**-2)) * dm
+        self.dt = lambda dm, f_i: (DM_CONSTANT * (f_i**-2 - self.backend.fmax**-2)) * dm
 
     def delays(self, dm):
         """Create array of delays for each backend frequency channel.
 
         Parameters
         ----------
-        dm:int
-            Value for dispersion measure of the pulse
+        dm:(int | Numpy.array)
+            Value for dispersion measure of the pulse, or array of values
 
         Returns
         -------
         delays:Numpy.array
-            Array of delays (in second)
+            Array of delays (in second), of shape (n_channels) or (n_dm, n_channels)
+
+        """
+        return self.dt(np.asarray(dm, dtype=float)[..., None], self.backend.frequencies)
+
+    def smearing(self, dm):
+        """Dispersion smearing within each channel.
+
+        Parameters
+        ----------
+        dm:(int | Numpy.array)
+            Value for dispersion measure of the pulse, or array of values
+
+        Returns
+        -------
+        smearing:Numpy.array
+            Delay across each channel (in second), of shape (n_channels) or (n_dm, n_channels)
+
+        """
+        frequencies = self.backend.frequencies
+        return (DM_CONSTANT * (frequencies**-2 - (frequencies + self.backend.channel_bandwidth)**-2) *
+                np.asarray(dm, dtype=float)[..., None])
+
+    def scattering_times(self):
+        """Scattering timescale of each channel (in second), proportional to frequency**-4."""
+        return self.scattering_time * (self.backend.frequencies / self.reference_frequency)**-4
+
+    def spectrum(self, spectral_index=None):
+        """Relative amplitude of each channel, proportional to frequency**spectral_index.
+
+        Parameters
+        ----------
+        spectral_index : (float | Numpy.array)
+            Spectral index, or array of values (default: self.spectral_index)
+
+        Returns
+        -------
+        spectrum : Numpy.array
+            Amplitudes of mean 1 (the mean of a flat spectrum), of shape (n_channels)
+            or (n_indices, n_channels)
+
+        """
+        if spectral_index is None:
+            spectral_index = self.spectral_index
+        spectrum = (self.backend.frequencies / self.reference_frequency)**np.asarray(spectral_index, dtype=float)[..., None]
+        return spectrum / spectrum.mean(axis=-1, keepdims=True)
+
+    def profiles(self, dm, sampling_time=None):
+        """Profile of the pulse in every channel, sampled at a sampling time.
+
+        The intrinsic profile, the smearing boxcar and the scattering tail of each
+        channel are integrated over every sample, then convolved together by
+        multiplying their Fourier transforms, for all channels (and DMs) at once.
+        Each component has a unit sum, so that the profile of every channel keeps
+        the fluence of the pulse however much it is broadened. The scattering tail
+        is cut after 8 timescales, and a Gaussian 4 sigma away from its peak.
+
+        Parameters
+        ----------
+        dm:(int | Numpy.array)
+            Value for dispersion measure of the pulse, or array of values
+        sampling_time : float
+            Sampling time (in second) (default: backend.sampling_time)
+
+        Returns
+        -------
+        profiles:Numpy.array
+            Profiles of unit sum (spectrum not applied), of shape (n_channels, n_samples)
+            or (n_dm, n_channels, n_samples)
+        lead:int
+            Number of samples of the profiles before the start of the pulse (the
+            dispersion delay of the channel), for Gaussians starting earlier
 
         """
-        return np.array([self.dt(dm, f) for f in self.backend.frequencies])
+        if sampling_time is None:
+            sampling_time = self.backend.sampling_time
+        width = self.width / sampling_time
+        smearing = self.smearing(dm) / sampling_time
+        scattering = self.scattering_times() / sampling_time
+
+        # Intrinsic profile, centred on the middle of the boxcar it replaces
+        if self.profile == 'gaussian':
+            sigma = width / (2 * np.sqrt(2 * np.log(2)))
+            lead = max(0, int(np.ceil(4 * sigma - width / 2)))
+            edges = np.arange(int(np.ceil(lead + width / 2 + 4 * sigma)) + 1) - lead - width / 2
+            intrinsic = np.diff(erf(edges / (np.sqrt(2) * sigma))) / 2
+        else:
+            lead = 0
+            intrinsic = self._boxcar(width, int(np.ceil(width)))
+        smeared = self._boxcar(smearing[..., None], int(np.ceil(smearing.max())) if smearing.size else 1)
+        n_scattered = max(1, int(np.ceil(8 * scattering.max())))
+        edges = np.arange(n_scattered + 1) / np.maximum(scattering, 1e-12)[:, None]
+        scattered = -np.diff(np.exp(-np.minimum(edges, 700)), axis=-1)
+
+        n_samples = self.n_samples(dm, sampling_time)
+        n_fft = 1 << (n_samples - 1).bit_length()
+        spectra = [np.fft.rfft(kernel / kernel.sum(axis=-1, keepdims=True), n_fft)
+                   for kernel in (intrinsic, smeared, scattered)]
+        profiles = np.fft.irfft(spectra[0] * spectra[1] * spectra[2], n_fft)[..., :n_samples]
+        # Remove the round-off of the transforms where profiles vanish
+        profiles[profiles < 1e-12 * profiles.max(axis=-1, keepdims=True)] = 0
+        return profiles / profiles.sum(axis=-1, keepdims=True), lead
+
+    def n_samples(self, dm, sampling_time=None):
+        """Number of samples of the profiles of the pulse (see profiles).
+
+        Parameters
+        ----------
+        dm:(int | Numpy.array)
+            Value for dispersion measure of the pulse, or array of values
+        sampling_time : float
+            Sampling time (in second) (default: backend.sampling_time)
+
+        Returns
+        -------
+        n_samples:int
+            Length of the profiles of the largest DM
+
+        """
+        if sampling_time is None:
+            sampling_time = self.backend.sampling_time
+        width = self.width / sampling_time
+        if self.profile == 'gaussian':
+            sigma = width / (2 * np.sqrt(2 * np.log(2)))
+            lead = max(0, int(np.ceil(4 * sigma - width / 2)))
+            n_intrinsic = int(np.ceil(lead + width / 2 + 4 * sigma))
+        else:
+            n_intrinsic = max(1, int(np.ceil(width)))
+        smearing = self.smearing(dm) / sampling_time
+        n_smeared = max(1, int(np.ceil(smearing.max())) if smearing.size else 1)
+        n_scattered = max(1, int(np.ceil(8 * (self.scattering_times() / sampling_time).max())))
+        return n_intrinsic + n_smeared + n_scattered - 2
+
+    @staticmethod
+    def _boxcar(length, n_samples):
+        # Boxcar of (fractional) length starting at 0, integrated over each sample
+        samples = np.arange(max(1, n_samples))
+        return np.clip(np.minimum(samples + 1, np.maximum(length, 1e-12)) - samples, 0, 1)
 
     def plot_delay_v_frequency(self, dm, xscale='linear',
                                savefig=False, ext='png'):
@@ -63,10 +226,14 @@ class Pulse():
             figure's file extention (default: png)
 
         """
+        # Imported here, as the delay plans are built from Pulse
+        from .delays import delay_plan
+        delays = delay_plan(self.backend, dm).delays[0]
+
         ncols=1
         nrows=1
         fig, ax = plt.subplots(figsize=(10, 5), ncols=ncols, nrows=nrows)
-        ax.plot(self.delays(dm), self.backend.frequencies)
+        ax.plot(delays, self.backend.frequencies)
         ax.set_xlabel('Delay (s)')
         ax.set_ylabel('Frequency (MHz)')
         if xscale:
@@ -91,16 +258,20 @@ class Pulse():
             figure's file extention (default: png)
 
         """
+        # Imported here, as the delay plans are built from Pulse
+        from .delays import delay_plan
+        dispersed, dedispersed = delay_plan(self.backend, [dm, 0]).delays
+
         ncols=1
         nrows=1
         fig, ax = plt.subplots(figsize=(10, 6), ncols=ncols, nrows=nrows)
-        ax.plot(self.delays(dm), self.backend.frequencies, label='Dispersed signal in the zero-DM plane')
-        ax.plot(self.delays(0), self.backend.frequencies, label=r'De-dispersed signal (DM=%d pc/cm$^3$)' % dm)
+        ax.plot(dispersed, self.backend.frequencies, label='Dispersed signal in the zero-DM plane')
+        ax.plot(dedispersed, self.backend.frequencies, label=r'De-dispersed signal (DM=%d pc/cm$^3$)' % dm)
 
         min_dist = 99999999
         for x1, x2 in zip(
-            self.delays(dm=dm)[::step],
-            self.delays(0)[::step]
+            dispersed[::step],
+            dedispersed[::step]
         ):
             if min_dist > np.abs(x1-x2):
                 min_dist = np.abs(x1-x2)
@@ -108,8 +279,8 @@ class Pulse():
         if dm > 0:
             for y, x1, x2 in zip(
                 self.backend.frequencies[::step],
-                self.delays(dm=dm)[::step],
-                self.delays(0)[::step]
+                dispersed[::step],
+                dedispersed[::step]
             ):
                 head_length = (min_dist/2)-0.01 if ext == 'pdf' else min_dist/2
                 ax.arrow(
@@ -1,22 +1,66 @@
 """RFIm class."""
+import threading
 import numpy as np
+from .mask import RFIMask
+from .parallel import run_blocks
+from .dtypes import accumulation_dtype, to_dtype, quantisation
 
 
 class RFIm():
-    """RFIm class. A class for radio interference mitigation."""
+    """RFIm class. A class for radio interference mitigation.
+
+    Cleaners work in the data type of the data they are given: statistics are
+    accumulated in accumulation_dtype and replacement values are cast back
+    (rounded and clipped for integer data).
+    """
 
     def __init__(self):
         """Initialise RFIm class."""
         pass
 
-    def dm0clean(self, data, threshold=3.25):
-        dtmean = np.mean(data, axis=1)
-        dfmean = np.mean(data, axis=0)
+    def dm0clean(self, data, threshold=3.25, return_mask=False, block_size=64, workers=1):
+        """Zero-DM sigma cut: time samples whose mean over channels is an outlier are replaced by the channel means.
+
+        Parameters
+        ----------
+        data : Numpy.Array
+            2D Array
+        threshold : float
+            Threshold to use for sigma cut inequality
+        return_mask : bool
+            Leave data untouched and return the RFIMask of the samples that would be replaced
+        block_size : int
+            Number of channels processed together
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
+
+        """
+        n_channels, n_samples = data.shape
+        dtype = accumulation_dtype(data.dtype)
+        dtmean = np.empty(n_channels, dtype=dtype)
+        dfmean = np.empty(n_samples, dtype=dtype)
+
+        def means(start):
+            # Rows and columns are reduced independently, as by a single np.mean
+            dtmean[start:start + block_size] = np.mean(data[start:start + block_size], axis=1, dtype=dtype)
+            columns = slice(start * n_samples // n_channels, (start + block_size) * n_samples // n_channels)
+            dfmean[columns] = np.mean(data[:, columns], axis=0, dtype=dtype)
+
+        run_blocks(means, range(0, n_channels, block_size), workers)
         stdevf = np.std(dfmean)
         medf = np.median(dfmean)
         maskf = np.where(np.abs(dfmean - medf) > threshold*stdevf)[0]
-        # replace with mean spectrum
-        data[:, maskf] = dtmean[:, None]*np.ones(len(maskf))[None]
+        if return_mask:
+            mask = RFIMask(data.shape)
+            mask.flag_samples(maskf)
+            return mask
+
+        def replace(start):
+            # replace with mean spectrum
+            data[start:start + block_size, maskf] = to_dtype(dtmean[start:start + block_size, None]*np.ones(len(maskf))[None],
+                                                             data.dtype)
+
+        run_blocks(replace, range(0, n_channels, block_size), workers)
         return data
 
     def fdsc(self, data, bin_size=32, threshold=2.75):
@@ -71,9 +115,13 @@ class RFIm():
 
         return data
 
-    def fdsc_amber(self, data, bin_size=32, threshold=2.75, n_iter=1, symmetric=False):
+    def fdsc_amber(self, data, bin_size=32, threshold=2.75, n_iter=1, symmetric=False, block_size=256,
+                   return_mask=False, workers=1):
         """Frequency domain sigma cut.
 
+        Each spectrum (time sample) is cleaned independently; spectra are processed
+        block_size at a time, by workers threads.
+
         Parameters
         ----------
         data : Numpy.Array
@@ -86,15 +134,31 @@ class RFIm():
             Number of cleaning iteration
         symmetric : bool
             Filter equally or not on both side of the distribution
+        block_size : int
+            Number of spectra processed together
+        return_mask : bool
+            Leave data untouched and return the RFIMask of the samples that would be replaced
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
 
         """
-        for k in range(n_iter):
-            for t in range(data.shape[1]):
-                current = data[:, t]
-                dtmean_nobandpass = current - current.reshape(-1, bin_size).mean(-1).repeat(bin_size)
-                stdevt = np.std(dtmean_nobandpass)
+        n_bins = data.shape[0] // bin_size
+        dtype = accumulation_dtype(data.dtype)
+        mask = RFIMask(data.shape) if return_mask else None
+        lock = threading.Lock()
+
+        def clean(start):
+            # Spectra are made contiguous so that bin and spectrum statistics sum
+            # their values in the same order as when taking one spectrum at a time
+            spectra = np.ascontiguousarray(data[:, start:start + block_size].T, dtype=dtype)
+            bins = spectra.reshape(spectra.shape[0], n_bins, bin_size)
+            flags = np.zeros(spectra.shape, dtype=bool)
+            for k in range(n_iter):
+                bin_means = bins.mean(-1)
+                dtmean_nobandpass = (bins - bin_means[..., None]).reshape(spectra.shape)
+                stdevt = np.std(dtmean_nobandpass, axis=-1, keepdims=True)
                 # medt = np.median(dtmean_nobandpass)
-                medt = np.mean(dtmean_nobandpass)
+                medt = np.mean(dtmean_nobandpass, axis=-1, keepdims=True)
 
                 if symmetric:
                     maskt = np.abs(dtmean_nobandpass-medt) > threshold*stdevt
@@ -102,9 +166,17 @@ class RFIm():
                     maskt = dtmean_nobandpass > medt + threshold*stdevt
 
                 # replace with mean bin values
-                data[maskt, t] = current.reshape(-1, bin_size).mean(-1).repeat(bin_size)[maskt]
+                np.copyto(bins, bin_means[..., None], where=maskt.reshape(bins.shape))
+                flags |= maskt
 
-        return data
+            if return_mask:
+                with lock:
+                    mask.flag(flags.T, start=start)
+            else:
+                data[:, start:start + block_size] = to_dtype(spectra.T, data.dtype)
+
+        run_blocks(clean, range(0, data.shape[1], block_size), workers)
+        return mask.compress() if return_mask else data
 
     def tdsc(self, data, threshold=3.25, n_iter=1):
         """Time domain sigma cut.
@@ -132,9 +204,12 @@ class RFIm():
 
         return data
 
-    def tdsc_amber(self, data, threshold=3.25, n_iter=1, symmetric=False):
+    def tdsc_amber(self, data, threshold=3.25, n_iter=1, symmetric=False, block_size=8, return_mask=False, workers=1):
         """Time domain sigma cut as implemented in AA-ALERT RFIm.
 
+        Each channel is cleaned independently; channels are processed block_size at a time,
+        by workers threads.
+
         Parameters
         ----------
         data : Numpy.Array
@@ -145,27 +220,51 @@ class RFIm():
             Number of cleaning iteration
         symmetric : bool
             Filter equally or not on both side of the distribution
+        block_size : int
+            Number of channels processed together
+        return_mask : bool
+            Leave data untouched and return the RFIMask of the samples that would be replaced
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
 
         """
-        for k in range(n_iter):
-            for f in range(data.shape[0]):
-                dfmean = np.mean(data[f, :])
-                stdevf  = np.std(data[f, :])
+        dtype = accumulation_dtype(data.dtype)
+        mask = RFIMask(data.shape) if return_mask else None
+        lock = threading.Lock()
+
+        def clean(start):
+            channels = data[start:start + block_size]
+            if return_mask:
+                channels = channels.copy()
+                flags = np.zeros(channels.shape, dtype=bool)
+            for k in range(n_iter):
+                dfmean = np.mean(channels, axis=1, keepdims=True, dtype=dtype)
+                stdevf = np.std(channels, axis=1, keepdims=True, dtype=dtype)
 
                 if symmetric:
-                    maskf = np.where(np.abs(data[f, :] - dfmean) > threshold*stdevf)[0]
+                    maskf = np.abs(channels - dfmean) > threshold*stdevf
                 else:
-                    maskf = np.where(data[f, :] > dfmean + threshold*stdevf)[0]
+                    maskf = channels > dfmean + threshold*stdevf
 
-                data[f, maskf] = dfmean
+                np.copyto(channels, to_dtype(dfmean, data.dtype), where=maskf)
+                if return_mask:
+                    flags |= maskf
 
-        return data
+            if return_mask:
+                with lock:
+                    mask.flag(flags, channels=slice(start, start + block_size))
+
+        run_blocks(clean, range(0, data.shape[0], block_size), workers)
+        return mask.compress() if return_mask else data
 
-    def tdsc_per_channel(self, data, threshold=3.25, n_iter=1):
+    def tdsc_per_channel(self, data, threshold=3.25, n_iter=1, block_size=8, return_mask=False, workers=1):
         """Time domain sigma cut.
 
         (Code from https://github.com/liamconnor/arts-analysis/blob/master/triggers.py)
 
+        Each channel is cleaned independently; channels are processed block_size at a time,
+        by workers threads.
+
         Parameters
         ----------
         data : Numpy.Array
@@ -174,15 +273,310 @@ class RFIm():
             Threshold to use for sigma cut inequality
         n_iter : int
             Number of cleaning iteration
+        block_size : int
+            Number of channels processed together
+        return_mask : bool
+            Leave data untouched and return the RFIMask of the samples that would be replaced
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
+
+        """
+        dtype = accumulation_dtype(data.dtype)
+        mask = RFIMask(data.shape) if return_mask else None
+        lock = threading.Lock()
+
+        def clean(start):
+            channels = data[start:start + block_size]
+            if return_mask:
+                channels = channels.copy()
+                flags = np.zeros(channels.shape, dtype=bool)
+            for ii in range(n_iter):
+                dtmean = np.mean(channels, axis=1, keepdims=True, dtype=dtype)
+                dtsig = np.std(channels, axis=1, keepdims=True, dtype=dtype)
+                maskpc = np.abs(channels-dtmean)>threshold*dtsig
+                np.copyto(channels, to_dtype(dtmean, data.dtype), where=maskpc)
+                if return_mask:
+                    flags |= maskpc
+
+            if return_mask:
+                with lock:
+                    mask.flag(flags, channels=slice(start, start + block_size))
+
+        run_blocks(clean, range(0, data.shape[0], block_size), workers)
+        return mask.compress() if return_mask else data
+
+    def spectral_kurtosis(self, data, block_size=256, threshold=3., power=False, n_integrated=None, shape=1.,
+                          channel_block=64, return_mask=False, workers=1):
+        """Generalised spectral kurtosis (SK) flagger.
+
+        Each channel is split into blocks of M = block_size power samples P. From the
+        sums S1 = sum(P) and S2 = sum(P**2) of each block, the generalised SK estimator
+        (Nita & Gary 2010)
+
+            SK = (M N d + 1) / (M - 1) * (M S2 / S1**2 - 1)
+
+        has an expected value of 1 for Gaussian noise, with variance
+
+            2 N d (N d + 1) M**2 / ((M - 1) (M N d + 2) (M N d + 3))
+
+        where N is the number of spectra integrated per sample and d the shape of
+        their gamma distribution. Blocks whose SK deviates from 1 by more than
+        threshold standard deviations, such as intermittent or periodic RFI, are
+        replaced by the mean of the unflagged samples of their channel. Both sums
+        are computed in a single pass over the data, channel_block channels at a time,
+        by workers threads.
+        Samples after the last full block are not assessed.
+
+        Parameters
+        ----------
+        data : Numpy.Array
+            2D Array (n_channels, n_samples)
+        block_size : int
+            Number of samples M per SK estimate
+        threshold : float
+            Threshold to use for sigma cut inequality on SK
+        power : bool
+            Data are powers (e.g. from Baseband.channelise). Otherwise (default), data
+            are standardised powers x (zero mean and unit variance, as generated by
+            Observation), converted back to powers P = 1 + x / sqrt(N d). Integer data
+            are first standardised with the offset and scale of dtypes.quantisation.
+        n_integrated : int
+            Number of spectra N integrated per sample (default: 1 for powers, 16 for
+            standardised powers, i.e. 81.92 us ARTS samples of 195.3125 kHz channels)
+        shape : float
+            Shape d of the gamma distribution of each spectrum's power (default: 1,
+            for complex voltages)
+        channel_block : int
+            Number of channels processed together
+        return_mask : bool
+            Leave data untouched and return the RFIMask of the samples that would be replaced
+        workers : int
+            Number of threads (default: 1; None for the number of CPUs)
+
+        """
+        if n_integrated is None:
+            n_integrated = 1 if power else 16
+        n_channels, n_samples = data.shape
+        n_blocks = n_samples // block_size
+        n_d = n_integrated * shape
+        scale = (block_size * n_d + 1) / (block_size - 1)
+        sigma = np.sqrt(2 * n_d * (n_d + 1) * block_size**2 /
+                        ((block_size - 1) * (block_size * n_d + 2) * (block_size * n_d + 3)))
+
+        dtype = accumulation_dtype(data.dtype)
+        offset, level = quantisation(data.dtype)
+        flags = np.zeros((n_channels, n_blocks), dtype=bool)
+        sums = np.zeros((n_channels, n_blocks))
+
+        def estimate(start):
+            blocks = data[start:start + channel_block, :n_blocks * block_size].reshape(-1, n_blocks, block_size)
+            blocks = blocks.astype(dtype, copy=False)
+            if power:
+                p = blocks
+            else:
+                p = 1 + (blocks if data.dtype.kind == 'f' else (blocks - offset) / level) / np.sqrt(n_d)
+            s1 = p.sum(axis=-1)
+            s2 = np.einsum('ijk,ijk->ij', p, p)
+            sk = scale * (block_size * s2 / s1**2 - 1)
+            flags[start:start + channel_block] = np.abs(sk - 1) > threshold*sigma
+            sums[start:start + channel_block] = blocks.sum(axis=-1)
+
+        run_blocks(estimate, range(0, n_channels, channel_block), workers)
+
+        if return_mask:
+            mask = RFIMask(data.shape)
+            for start in range(0, n_channels, channel_block):
+                mask.flag(np.repeat(flags[start:start + channel_block], block_size, axis=1),
+                          channels=slice(start, start + channel_block))
+            return mask.compress()
+
+        # Mean of the unflagged blocks of each channel (of all blocks if all are flagged)
+        n_kept = (~flags).sum(axis=1)
+        means = np.where(n_kept > 0,
+                         np.where(flags, 0, sums).sum(axis=1) / np.maximum(n_kept, 1) / block_size,
+                         sums.sum(axis=1) / max(n_blocks * block_size, 1))
+
+        def replace(start):
+            channels = slice(start, start + channel_block)
+            blocks = data[channels, :n_blocks * block_size].reshape(-1, n_blocks, block_size)
+            np.copyto(blocks, to_dtype(means[channels, None, None], data.dtype), where=flags[channels, :, None])
+
+        run_blocks(replace, range(0, n_channels, channel_block), workers)
+        return data
+
+    def fused_chain(self, data, steps=('dm0', 'time', 'frequency'), tile_size=128, channel_block=8):
+        """Chain of dm0clean, tdsc_amber and fdsc_amber applied tile by tile.
+
+        Frequency domain cuts only need the spectra of a tile of time samples, but
+        dm0 and time domain cuts need statistics of the whole window after the
+        preceding steps: those are accumulated while the preceding steps are
+        applied, so that each pass over the window applies every pending step at
+        once. Passes including a frequency domain cut go over tiles of tile_size
+        time samples, transposed once into contiguous spectra and written back
+        once; other passes go over blocks of channel_block channels in place. The
+        statistics of a time domain cut directly following dm0 are derived from
+        those of the dm0 pass, so the default chain reads the window twice and
+        writes it once. Flags match the sequential chain, except where rounding
+        differences in the accumulated statistics move a sample across a threshold.
+
+        Parameters
+        ----------
+        data : Numpy.Array
+            2D Array (n_channels, n_samples)
+        steps : list
+            Steps in order, each a name ('dm0', 'time' or 'frequency') or a (name, kwargs)
+            pair, kwargs being the parameters of dm0clean, tdsc_amber or fdsc_amber
+            (e.g. ('time', {'threshold': 3., 'n_iter': 2}))
+        tile_size : int
+            Number of time samples per tile
+        channel_block : int
+            Number of channels per block
+
+        """
+        chain = []
+        for step in steps:
+            name, kwargs = (step, {}) if isinstance(step, str) else step
+            kwargs = dict(kwargs)
+            if name == 'time':
+                chain += [(name, kwargs)] * kwargs.pop('n_iter', 1)
+            elif name in ('dm0', 'frequency'):
+                chain.append((name, kwargs))
+            else:
+                raise ValueError("Unknown step %s" % name)
+
+        n_channels, n_samples = data.shape
+        dtype = accumulation_dtype(data.dtype)
+        pending = []
+        while chain or pending:
+            # Frequency domain cuts run with the pending steps, up to the next step needing whole-window statistics
+            while chain and chain[0][0] == 'frequency':
+                pending.append(chain.pop(0) + (None,))
+            collect = []
+            if chain:
+                collect.append(chain.pop(0))
+                if collect[0][0] == 'dm0' and chain and chain[0][0] == 'time':
+                    collect.append(chain.pop(0))
+            names = [name for name, kwargs in collect]
+
+            sums = np.zeros(n_channels)
+            column_sums = np.zeros(n_samples)
+            shift = s1 = s2 = None
+            transpose = any(name == 'frequency' for name, kwargs, stats in pending)
+            if transpose:
+                tiles = [(slice(None), slice(t, t + tile_size)) for t in range(0, n_samples, tile_size)]
+            else:
+                tiles = [(slice(c, c + channel_block), slice(None)) for c in range(0, n_channels, channel_block)]
+
+            for rows, columns in tiles:
+                if transpose:
+                    # Contiguous spectra (time samples as rows)
+                    tile, time_axis = np.ascontiguousarray(data[rows, columns].T, dtype=dtype), 0
+                else:
+                    tile, time_axis = data[rows, columns], 1
+                self._apply_steps(tile, pending, rows, columns, time_axis)
+                if transpose and pending:
+                    data[rows, columns] = to_dtype(tile.T, data.dtype)
+
+                if 'dm0' in names:
+                    sums[rows] += tile.sum(axis=time_axis, dtype=dtype)
+                    column_sums[columns] += tile.sum(axis=1 - time_axis, dtype=dtype)
+                if 'time' in names:
+                    # Sums of deviations from a rough mean (of the first tile) avoid cancellation
+                    if shift is None:
+                        shift, s1, s2 = np.zeros(n_channels), np.zeros(n_channels), np.zeros(n_channels)
+                        shift[:] = tile.mean(axis=time_axis) if transpose else 0
+                    if not transpose:
+                        shift[rows] = tile.mean(axis=1)
+                    deviations = tile - np.expand_dims(shift[rows], time_axis)
+                    s1[rows] += deviations.sum(axis=time_axis)
+                    s2[rows] += np.einsum('ij,ij->j' if transpose else 'ij,ij->i', deviations, deviations)
+
+            pending = []
+            for name, kwargs in collect:
+                if name == 'dm0':
+                    dtmean = sums / n_samples
+                    dfmean = column_sums / n_channels
+                    stdevf = np.std(dfmean)
+                    medf = np.median(dfmean)
+                    maskf = np.abs(dfmean - medf) > kwargs.get('threshold', 3.25)*stdevf
+                    pending.append((name, kwargs, (dtmean, maskf)))
+                    if 'time' in names:
+                        # dm0 replaces the flagged samples by the channel mean
+                        deviations = data[:, maskf] - shift[:, None]
+                        s1 += maskf.sum() * (dtmean - shift) - deviations.sum(axis=1)
+                        s2 += maskf.sum() * (dtmean - shift)**2 - np.einsum('ij,ij->i', deviations, deviations)
+                else:
+                    mean = s1 / n_samples
+                    stdev = np.sqrt(np.maximum(s2 / n_samples - mean**2, 0))
+                    pending.append((name, kwargs, (shift + mean, stdev)))
+
+        return data
+
+    def _apply_steps(self, tile, steps, rows, columns, time_axis):
+        # Apply chain steps to the tile data[rows, columns], whose time axis is 0
+        # (contiguous spectra, needed by frequency domain cuts) or 1 (channels)
+        for name, kwargs, stats in steps:
+            if name == 'dm0':
+                dtmean, maskf = stats
+                if time_axis == 0:
+                    tile[maskf[columns]] = to_dtype(dtmean[rows], tile.dtype)
+                else:
+                    tile[:, maskf[columns]] = to_dtype(dtmean[rows, None], tile.dtype)
+            elif name == 'time':
+                dfmean, stdevf = (np.expand_dims(stat[rows], time_axis) for stat in stats)
+                threshold = kwargs.get('threshold', 3.25)
+                if kwargs.get('symmetric', False):
+                    maskf = np.abs(tile - dfmean) > threshold*stdevf
+                else:
+                    maskf = tile > dfmean + threshold*stdevf
+                np.copyto(tile, to_dtype(dfmean, tile.dtype), where=maskf)
+            else:
+                bin_size = kwargs.get('bin_size', 32)
+                threshold = kwargs.get('threshold', 2.75)
+                bins = tile.reshape(tile.shape[0], -1, bin_size)
+                for k in range(kwargs.get('n_iter', 1)):
+                    bin_means = bins.mean(-1)
+                    dtmean_nobandpass = bins - bin_means[..., None]
+                    medt = dtmean_nobandpass.mean(axis=(1, 2))[:, None, None]
+                    stdevt = np.sqrt(np.maximum(np.einsum('ijk,ijk->i', dtmean_nobandpass, dtmean_nobandpass) /
+                                                tile.shape[1] - medt[:, 0, 0]**2, 0))[:, None, None]
+                    if kwargs.get('symmetric', False):
+                        maskt = np.abs(dtmean_nobandpass-medt) > threshold*stdevt
+                    else:
+                        maskt = dtmean_nobandpass > medt + threshold*stdevt
+                    np.copyto(bins, bin_means[..., None], where=maskt)
+
+    def apply_mask(self, data, mask, replacement=None, block_size=4096):
+        """Replace flagged samples.
+
+        The mask is decoded block_size time samples at a time, so that it is never
+        expanded to one byte per sample of the whole window.
+
+        Parameters
+        ----------
+        data : Numpy.Array
+            2D Array (n_channels, n_samples)
+        mask : RFIMask
+            Flagged samples of data
+        replacement : (float | Numpy.Array)
+            Value, or value per channel, replacing flagged samples (default: the
+            mean of the unflagged samples of each channel)
+        block_size : int
+            Number of time samples processed together
 
         """
-        for ii in range(n_iter):
-            dtmean = np.mean(data, axis=1, keepdims=True)
-            dtsig = np.std(data, axis=1)
-            for nu in range(data.shape[0]):
-                d = dtmean[nu]
-                sig = dtsig[nu]
-                maskpc = np.where(np.abs(data[nu]-d)>threshold*sig)[0]
-                data[nu][maskpc] = d
+        if replacement is None:
+            sums = np.zeros(data.shape[0])
+            counts = np.zeros(data.shape[0])
+            for start in range(0, data.shape[1], block_size):
+                flags = mask.to_bool(start, min(start + block_size, data.shape[1]))
+                sums += np.where(flags, 0, data[:, start:start + block_size]).sum(axis=1)
+                counts += flags.shape[1] - flags.sum(axis=1)
+            replacement = sums / np.maximum(counts, 1)
+        replacement = to_dtype(np.reshape(replacement, (-1, 1)), data.dtype)
+
+        for start in range(0, data.shape[1], block_size):
+            flags = mask.to_bool(start, min(start + block_size, data.shape[1]))
+            np.copyto(data[:, start:start + block_size], replacement, where=flags, casting='unsafe')
 
         return data
@@ -0,0 +1,258 @@
+"""Stage and Runtime classes."""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Marks the end of the stream in the queues
+_END = object()
+
+
+class Stage():
+    """Stage class. One step of a Runtime, applied to every item of the stream in order."""
+
+    def __init__(self, function, name=None, blocking=True, flush=None):
+        """Initialise Stage class.
+
+        Parameters
+        ----------
+        function : callable
+            Function taking an item and returning the item passed downstream
+        name : str
+            Name of the stage in the statistics (default: the function name)
+        blocking : bool
+            Run the function in the runtime's executor, as CPU-bound (numpy) kernels
+            should, rather than in the event loop (default: True)
+        flush : callable
+            Function without argument called at the end of the stream, whose output
+            is passed downstream as a last item, e.g. to release held back state
+            (default: none)
+
+        """
+        self.function = function
+        self.name = getattr(function, '__name__', 'stage') if name is None else name
+        self.blocking = blocking
+        self.flush = flush
+        self.reset()
+
+    def reset(self):
+        """Reset the statistics."""
+        self.n_items = 0
+        # Time spent running the function, waiting for input (starved) and
+        # waiting for room downstream (stalled by backpressure), in second
+        self.busy_time = 0.
+        self.starved_time = 0.
+        self.stalled_time = 0.
+
+    @property
+    def stats(self):
+        """Statistics of the stage."""
+        return {'items': self.n_items,
+                'busy_time': self.busy_time,
+                'starved_time': self.starved_time,
+                'stalled_time': self.stalled_time}
+
+
+class Runtime():
+    """Runtime class. Runs stages concurrently, connected by bounded asyncio queues.
+
+    Each stage processes its items one at a time and in order, so stateful stages
+    (e.g. chunked dedispersion) stay consistent, while different stages work on
+    different items at the same time: ingest, compute and output overlap. A full
+    queue blocks the stage feeding it, so a slow stage slows down everything
+    upstream, down to reading the source, instead of letting items pile up.
+    """
+
+    def __init__(self, stages, max_queue_size=2, executor=None):
+        """Initialise Runtime class.
+
+        Parameters
+        ----------
+        stages : list
+            Stage instances (or callables, wrapped as blocking stages), in order
+        max_queue_size : int
+            Number of items each queue holds before blocking its producer (default: 2)
+        executor : concurrent.futures.Executor
+            Executor of the blocking stages (default: a thread pool with one thread
+            per stage plus one for the source)
+
+        """
+        self.stages = [stage if isinstance(stage, Stage) else Stage(stage) for stage in stages]
+        self.max_queue_size = max_queue_size
+        self.executor = executor
+        self.queues = []
+        self.max_depths = np.zeros(len(self.stages), dtype=int)
+        self.sum_depths = np.zeros(len(self.stages))
+        self.n_puts = np.zeros(len(self.stages), dtype=int)
+        self.source_stalled_time = 0.
+        self.wall_time = 0.
+        # StreamingPipeline whose processing time runs account for (see from_pipeline)
+        self.pipeline = None
+
+    @classmethod
+    def from_pipeline(cls, pipeline, sink=None, max_queue_size=2, executor=None):
+        """Runtime of the stages of a StreamingPipeline.
+
+        The cleaning stage writes into a pool of max_queue_size + 2 preallocated
+        chunk buffers, enough for every chunk in flight, so memory stays constant.
+        The wall time of every run is added to the processing_time of the pipeline,
+        so that its real_time_factor measures the throughput of the runtime.
+
+        Parameters
+        ----------
+        pipeline : StreamingPipeline
+            The pipeline whose clean, dedisperse and search steps become stages
+        sink : callable
+            Candidate writing stage, taking each chunk's Candidates (default: none,
+            the runtime returns the Candidates)
+        max_queue_size : int
+            Number of items each queue holds before blocking its producer (default: 2)
+        executor : concurrent.futures.Executor
+            Executor of the stages (default: see Runtime)
+
+        Returns
+        -------
+        runtime : Runtime
+            The runtime
+
+        """
+        buffers = np.zeros((max_queue_size + 2,) + pipeline.chunk.shape, dtype=pipeline.chunk.dtype)
+        n_cleaned = [0]
+
+        def clean(chunk):
+            out = buffers[n_cleaned[0] % len(buffers)]
+            n_cleaned[0] += 1
+            return pipeline.clean(chunk, out=out)
+
+        stages = [Stage(clean, name='clean'),
+                  Stage(pipeline.dedisperse, name='dedisperse'),
+                  Stage(pipeline.search, name='search', flush=pipeline.flush)]
+        if sink is not None:
+            stages.append(Stage(sink, name='write'))
+        runtime = cls(stages, max_queue_size=max_queue_size, executor=executor)
+        runtime.pipeline = pipeline
+        return runtime
+
+    async def _put(self, index, item, stage=None):
+        start_time = time.perf_counter()
+        await self.queues[index].put(item)
+        if stage is None:
+            self.source_stalled_time += time.perf_counter() - start_time
+        else:
+            stage.stalled_time += time.perf_counter() - start_time
+        depth = self.queues[index].qsize()
+        self.max_depths[index] = max(self.max_depths[index], depth)
+        self.sum_depths[index] += depth
+        self.n_puts[index] += 1
+
+    async def _ingest(self, source, executor):
+        loop = asyncio.get_running_loop()
+        if hasattr(source, '__aiter__'):
+            async for item in source:
+                await self._put(0, item)
+        else:
+            # Reading the source (e.g. from disk) may block, so it runs in the executor too
+            iterator = iter(source)
+            while True:
+                item = await loop.run_in_executor(executor, next, iterator, _END)
+                if item is _END:
+                    break
+                await self._put(0, item)
+        await self._put(0, _END)
+
+    async def _work(self, index, executor, results):
+        loop = asyncio.get_running_loop()
+        stage = self.stages[index]
+        last = index == len(self.stages) - 1
+        while True:
+            start_time = time.perf_counter()
+            item = await self.queues[index].get()
+            stage.starved_time += time.perf_counter() - start_time
+            if item is _END:
+                if stage.flush is None:
+                    break
+                function, arguments = stage.flush, ()
+            else:
+                function, arguments = stage.function, (item,)
+
+            start_time = time.perf_counter()
+            if stage.blocking:
+                item = await loop.run_in_executor(executor, function, *arguments)
+            else:
+                item = function(*arguments)
+            stage.busy_time += time.perf_counter() - start_time
+            stage.n_items += 1
+
+            if last:
+                if results is not None:
+                    results.append(item)
+            else:
+                await self._put(index + 1, item, stage)
+            if function is stage.flush:
+                break
+        if not last:
+            await self._put(index + 1, _END, stage)
+
+    async def run(self, source, collect=True):
+        """Run the stages over a stream of items.
+
+        Parameters
+        ----------
+        source : iterable
+            Items (or async iterable of items) fed to the first stage, e.g. Observation.iter_chunks()
+        collect : bool
+            Return the outputs of the last stage (default: True)
+
+        Returns
+        -------
+        results : list
+            Outputs of the last stage, in order (None if collect is False)
+
+        """
+        self.queues = [asyncio.Queue(maxsize=self.max_queue_size) for _ in self.stages]
+        for stage in self.stages:
+            stage.reset()
+        self.max_depths[:] = 0
+        self.sum_depths[:] = 0
+        self.n_puts[:] = 0
+        self.source_stalled_time = 0.
+        results = [] if collect else None
+
+        executor = self.executor
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=len(self.stages) + 1)
+        start_time = time.perf_counter()
+        tasks = [asyncio.ensure_future(self._ingest(source, executor))]
+        tasks += [asyncio.ensure_future(self._work(i, executor, results)) for i in range(len(self.stages))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # A failing stage stops the others rather than leaving them blocked on a queue
+            for task in tasks:
+                task.cancel()
+            self.wall_time = time.perf_counter() - start_time
+            if self.pipeline is not None:
+                self.pipeline.processing_time += self.wall_time
+            if self.executor is None:
+                executor.shutdown(wait=True)
+        return results
+
+    def run_sync(self, source, collect=True):
+        """Run the stages over a stream of items from synchronous code (see run)."""
+        return asyncio.run(self.run(source, collect=collect))
+
+    def queue_depths(self):
+        """Current number of items waiting in front of each stage."""
+        return [queue.qsize() for queue in self.queues]
+
+    @property
+    def stats(self):
+        """Statistics of each stage, with the depth of the queue in front of it."""
+        stats = {}
+        for i, stage in enumerate(self.stages):
+            stats[stage.name] = dict(stage.stats,
+                                     max_queue_depth=int(self.max_depths[i]),
+                                     mean_queue_depth=float(self.sum_depths[i] / max(self.n_puts[i], 1)))
+        stats['source_stalled_time'] = self.source_stalled_time
+        stats['wall_time'] = self.wall_time
+        return stats
@@ -1,5 +1,6 @@
 """SNR class."""
 import numpy as np
+from .parallel import n_workers, run_blocks
 
 class SNR():
     """SNR class. A class for signal-to-noise computation."""
@@ -28,3 +29,149 @@ class SNR():
 
         vals = np.where(sd == 0, 0, (m-m.mean())/sd)
         return vals
+
+    def robust_noise(self, a, axis=-1, max_samples=1024):
+        """Estimate the noise level of data robustly against outliers (e.g. pulses).
+
+        The median and the median absolute deviation (scaled to a gaussian standard
+        deviation) are computed over an evenly strided subset of at most max_samples
+        samples along the axis.
+
+        Parameters
+        ----------
+        a : list or numpy array
+            Array of data
+        axis : int
+            Axis along which to estimate the noise (default: -1)
+        max_samples : int
+            Largest number of samples used for the estimate (default: 1024)
+
+        Returns
+        -------
+        median : array of float
+            Median along the axis
+        sigma : array of float
+            Standard deviation along the axis
+        """
+        a = np.moveaxis(np.asanyarray(a), axis, -1)
+        subset = a[..., ::max(1, a.shape[-1] // max_samples)]
+        median = np.median(subset, axis=-1)
+        sigma = 1.4826 * np.median(np.abs(subset - median[..., None]), axis=-1)
+        return median, sigma
+
+    def _row_parts(self, n_rows, workers, block_rows=8):
+        """Split rows into one part per worker, of whole blocks of block_rows rows."""
+        part_rows = block_rows * max(1, int(np.ceil(n_rows / (block_rows * n_workers(workers)))))
+        return [slice(start, min(start + part_rows, n_rows)) for start in range(0, n_rows, part_rows)]
+
+    def _boxcar_filter(self, a, widths, dtype, block_rows=8):
+        """Yield boxcar S/N series, block of rows by block of rows so that sums stay in cache."""
+        median, sigma = self.robust_noise(a)
+        scale = (1 / np.where(sigma == 0, np.inf, sigma)).astype(dtype)
+        median = median.astype(dtype)
+        n_samples = a.shape[-1]
+
+        sums = np.zeros((block_rows, n_samples + 1), dtype=dtype)
+        current = np.empty((block_rows, n_samples), dtype=dtype)
+        for start in range(0, a.shape[0], block_rows):
+            rows = slice(start, min(start + block_rows, a.shape[0]))
+            n_rows = rows.stop - rows.start
+            np.subtract(a[rows], median[rows, None], out=sums[:n_rows, 1:])
+            np.cumsum(sums[:n_rows, 1:], axis=-1, out=sums[:n_rows, 1:])
+            for i, width in enumerate(widths):
+                if width > n_samples:
+                    continue
+                filtered = current[:n_rows, :n_samples - width + 1]
+                np.subtract(sums[:n_rows, width:], sums[:n_rows, :-width], out=filtered)
+                filtered *= scale[rows, None] / np.sqrt(width, dtype=dtype)
+                yield rows, i, filtered
+
+    def boxcar_snr(self, a, widths=(1, 2, 4, 8, 16, 32, 64, 128), axis=-1, dtype=np.float32, workers=1):
+        """Compute signal-to-noise ratio of boxcar (matched) filters of several widths.
+
+        Boxcar sums are differences of a cumulative sum, so that each width costs O(N)
+        regardless of its size. The noise is estimated robustly on the unfiltered data
+        (see robust_noise) and scaled by the square root of the width.
+
+        Parameters
+        ----------
+        a : list or numpy array
+            Array of data, e.g. a DM-time plane (n_dm, n_samples)
+        widths : list of int
+            Boxcar widths (in samples) (default: powers of two from 1 to 128)
+        axis : int
+            Axis along which to filter (default: -1)
+        dtype : numpy dtype
+            Type of the cumulative sums and of the output (default: float32)
+        workers : int
+            Number of threads, each filtering a part of the rows (default: 1; None for the number of CPUs)
+
+        Returns
+        -------
+        vals : array of float
+            S/N of the boxcar starting at each sample, for each width (n_widths, ...) with
+            the filtered axis last. Boxcars running past the end of the data are 0.
+        """
+        a = np.moveaxis(np.asanyarray(a), axis, -1)
+        shape = a.shape
+        a = a.reshape(-1, shape[-1])
+
+        vals = np.zeros((len(widths),) + a.shape, dtype=dtype)
+
+        def snr(part):
+            for rows, i, filtered in self._boxcar_filter(a[part], widths, dtype):
+                vals[i, part, :filtered.shape[1]][rows] = filtered
+
+        run_blocks(snr, self._row_parts(a.shape[0], workers), workers)
+        return vals.reshape((len(widths),) + shape)
+
+    def boxcar_peak(self, a, widths=(1, 2, 4, 8, 16, 32, 64, 128), axis=-1, dtype=np.float32, workers=1):
+        """Compute the best boxcar signal-to-noise ratio over several widths.
+
+        Same as boxcar_snr, without keeping the S/N of every width in memory.
+
+        Parameters
+        ----------
+        a : list or numpy array
+            Array of data, e.g. a DM-time plane (n_dm, n_samples)
+        widths : list of int
+            Boxcar widths (in samples) (default: powers of two from 1 to 128)
+        axis : int
+            Axis along which to filter (default: -1)
+        dtype : numpy dtype
+            Type of the cumulative sums and of the output (default: float32)
+        workers : int
+            Number of threads, each filtering a part of the rows (default: 1; None for the number of CPUs)
+
+        Returns
+        -------
+        vals : array of float
+            Best S/N of the boxcars starting at each sample, with the filtered axis last
+        width_index : array of int
+            Index in widths of the best boxcar (smallest unsigned type holding len(widths))
+        """
+        a = np.moveaxis(np.asanyarray(a), axis, -1)
+        shape = a.shape
+        a = a.reshape(-1, shape[-1])
+
+        vals = np.full(a.shape, -np.inf, dtype=dtype)
+        width_index = np.zeros(a.shape, dtype=np.min_scalar_type(len(widths)))
+
+        def peak(part):
+            better = np.empty((8, a.shape[1]), dtype=bool)
+            update = np.empty(better.shape, dtype=width_index.dtype)
+            for rows, i, filtered in self._boxcar_filter(a[part], widths, dtype, block_rows=8):
+                n_rows, n_samples = filtered.shape
+                best = vals[part][rows, :n_samples]
+                index = width_index[part][rows, :n_samples]
+                # Widths come in increasing index order, so the best width so far has the
+                # largest index of the widths that did better than the ones before (same
+                # result as np.copyto(index, i, where=better), without its branch per sample)
+                np.greater(filtered, best, out=better[:n_rows, :n_samples])
+                np.multiply(better[:n_rows, :n_samples], update.dtype.type(i), out=update[:n_rows, :n_samples])
+                np.maximum(index, update[:n_rows, :n_samples], out=index)
+                np.maximum(best, filtered, out=best)
+            vals[part][np.isinf(vals[part])] = 0
+
+        run_blocks(peak, self._row_parts(a.shape[0], workers), workers)
+        return vals.reshape(shape), width_index.reshape(shape)
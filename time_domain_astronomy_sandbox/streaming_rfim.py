@@ -0,0 +1,223 @@
+"""RunningStatistics, StreamingTimeCleaner and StreamingFrequencyCleaner classes."""
+import numpy as np
+from scipy.signal import lfilter
+from .mask import RFIMask
+from .dtypes import accumulation_dtype, to_dtype
+
+
+class RunningStatistics():
+    """RunningStatistics class. Exponentially weighted running mean of rows of a stream."""
+
+    def __init__(self, n_rows, time_constant):
+        """Initialise RunningStatistics class.
+
+        The mean is a first-order recursive filter, run with scipy.signal.lfilter
+        whose state is carried from one chunk to the next, so it does not depend on
+        how the stream is cut into chunks. Early means are bias corrected (divided by
+        the total weight of the samples seen so far).
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of rows (e.g. channels)
+        time_constant : float
+            Number of samples over which weights decay by a factor e
+
+        """
+        self.n_rows = n_rows
+        self.time_constant = time_constant
+        self.decay = 1 - 1 / time_constant
+        self.reset()
+
+    def reset(self):
+        """Forget all samples."""
+        self.zi = np.zeros((self.n_rows, 1))
+        self.last = np.zeros((self.n_rows, 1))
+        self.n_samples = 0
+
+    def update(self, values):
+        """Add the next samples of every row.
+
+        Parameters
+        ----------
+        values : Numpy.Array
+            2D Array (n_rows, n_samples)
+
+        Returns
+        -------
+        previous : Numpy.Array
+            Mean before each sample (n_rows, n_samples), i.e. of the samples preceding
+            it only. It is 0 before the first sample of the stream.
+
+        """
+        n_samples = values.shape[1]
+        filtered, self.zi = lfilter([1 - self.decay], [1, -self.decay], values, axis=1, zi=self.zi)
+        filtered /= 1 - self.decay**np.arange(self.n_samples + 1, self.n_samples + n_samples + 1)
+
+        previous = np.empty_like(filtered)
+        previous[:, :1] = self.last
+        previous[:, 1:] = filtered[:, :-1]
+        self.last = filtered[:, -1:]
+        self.n_samples += n_samples
+        return previous
+
+
+class StreamingTimeCleaner():
+    """StreamingTimeCleaner class. Time domain sigma cut with running statistics per channel."""
+
+    def __init__(self,
+                 n_channels:int,
+                 threshold:float = 3.25,
+                 time_constant:float = 4096, # samples
+                 symmetric:bool = False,
+                 warmup:int = 64 # samples
+                ):
+        """Initialise StreamingTimeCleaner class.
+
+        Like RFIm.tdsc_amber, samples more than threshold standard deviations above
+        (or away from, if symmetric) the mean of their channel are replaced by that
+        mean. The mean and standard deviation are running statistics of the preceding
+        samples of the channel, carried across chunks, so each chunk is cleaned in a
+        single pass and the result does not depend on the chunk size. Flagged samples
+        still enter the statistics, which keeps them linear filters of the data.
+
+        Parameters
+        ----------
+        n_channels : int
+            Number of channels
+        threshold : float
+            Threshold to use for sigma cut inequality
+        time_constant : float
+            Number of samples over which the statistics forget the past (by a factor e)
+        symmetric : bool
+            Filter equally or not on both side of the distribution
+        warmup : int
+            Number of samples of the stream before flagging starts
+
+        """
+        self.threshold = threshold
+        self.symmetric = symmetric
+        self.warmup = warmup
+        self.mean = RunningStatistics(n_channels, time_constant)
+        self.square = RunningStatistics(n_channels, time_constant)
+
+    def reset(self):
+        """Forget the running statistics."""
+        self.mean.reset()
+        self.square.reset()
+
+    def clean(self, chunk, return_mask=False):
+        """Clean the next chunk in place.
+
+        Parameters
+        ----------
+        chunk : Numpy.Array
+            2D Array (n_channels, n_samples), following the previous chunk in time
+        return_mask : bool
+            Leave the chunk untouched and return the RFIMask of the samples to replace
+
+        """
+        start = self.mean.n_samples
+        dfmean = self.mean.update(chunk)
+        # Squared in the accumulation type, as integer data overflow in their own
+        squares = np.square(chunk, dtype=accumulation_dtype(chunk.dtype))
+        stdevf = np.sqrt(np.maximum(self.square.update(squares) - dfmean**2, 0))
+
+        if self.symmetric:
+            maskf = np.abs(chunk - dfmean) > self.threshold*stdevf
+        else:
+            maskf = chunk > dfmean + self.threshold*stdevf
+        maskf[:, :max(0, self.warmup - start)] = False
+
+        if return_mask:
+            return RFIMask.from_bool(maskf)
+        np.copyto(chunk, to_dtype(dfmean, chunk.dtype), where=maskf)
+        return chunk
+
+    __call__ = clean
+
+
+class StreamingFrequencyCleaner():
+    """StreamingFrequencyCleaner class. Frequency domain sigma cut with running statistics per frequency bin."""
+
+    def __init__(self,
+                 n_channels:int,
+                 bin_size:int = 32,
+                 threshold:float = 2.75,
+                 time_constant:float = 4096, # samples
+                 symmetric:bool = False,
+                 warmup:int = 64 # samples
+                ):
+        """Initialise StreamingFrequencyCleaner class.
+
+        Like RFIm.fdsc_amber, each spectrum is compared to its mean per bin of
+        bin_size channels, and channels deviating by more than threshold standard
+        deviations are replaced by the bin mean. Here the bandpass is first removed
+        with the running mean of each channel, and the standard deviation is the
+        running deviation within each bin, both from preceding samples and carried
+        across chunks: the result does not depend on the chunk size.
+
+        Parameters
+        ----------
+        n_channels : int
+            Number of channels, a multiple of bin_size
+        bin_size : int
+            Size of averaging bin
+        threshold : float
+            Threshold to use for sigma cut inequality
+        time_constant : float
+            Number of samples over which the statistics forget the past (by a factor e)
+        symmetric : bool
+            Filter equally or not on both side of the distribution
+        warmup : int
+            Number of samples of the stream before flagging starts
+
+        """
+        self.n_bins = n_channels // bin_size
+        self.bin_size = bin_size
+        self.threshold = threshold
+        self.symmetric = symmetric
+        self.warmup = warmup
+        self.bandpass = RunningStatistics(n_channels, time_constant)
+        self.variance = RunningStatistics(self.n_bins, time_constant)
+
+    def reset(self):
+        """Forget the running statistics."""
+        self.bandpass.reset()
+        self.variance.reset()
+
+    def clean(self, chunk, return_mask=False):
+        """Clean the next chunk in place.
+
+        Parameters
+        ----------
+        chunk : Numpy.Array
+            2D Array (n_channels, n_samples), following the previous chunk in time
+        return_mask : bool
+            Leave the chunk untouched and return the RFIMask of the samples to replace
+
+        """
+        n_samples = chunk.shape[1]
+        start = self.bandpass.n_samples
+        bandpass = self.bandpass.update(chunk).reshape(self.n_bins, self.bin_size, n_samples)
+
+        residual = chunk.reshape(self.n_bins, self.bin_size, n_samples) - bandpass
+        bin_means = residual.mean(axis=1, keepdims=True)
+        residual -= bin_means
+        stdevt = np.sqrt(self.variance.update(np.mean(residual**2, axis=1)))[:, None]
+
+        if self.symmetric:
+            maskt = np.abs(residual) > self.threshold*stdevt
+        else:
+            maskt = residual > self.threshold*stdevt
+        maskt[..., :max(0, self.warmup - start)] = False
+        maskt = maskt.reshape(chunk.shape)
+
+        if return_mask:
+            return RFIMask.from_bool(maskt)
+        # replace with mean bin values
+        bandpass += bin_means
+        np.copyto(chunk, to_dtype(bandpass.reshape(chunk.shape), chunk.dtype), where=maskt)
+        return chunk
+
+    __call__ = clean